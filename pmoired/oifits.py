@@ -1,11 +1,12 @@
 import copy
+import functools
 import glob
 import os
 from collections import OrderedDict
 
 import numpy as np
 from astropy.io import fits
-import scipy.signal
+import scipy.ndimage
 from astropy.time import Time
 from astropy.coordinates import SkyCoord, EarthLocation
 import astropy.constants as aC
@@ -40,7 +41,7 @@ def _globlist(filenames, strict=False):
 def loadOI(filename, insname=None, targname=None, verbose=True,
            withHeader=False, medFilt=None, tellurics=None, debug=False,
            binning=None, useTelluricsWL=True, barycentric=False, ignoreCF=False,
-           wlOffset=0.0):
+           wlOffset=0.0, memmap=False, dtype=np.float64):
     """
     load OIFITS "filename" and return a dict:
 
@@ -69,6 +70,11 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
     binning: binning factor (integer)
     useTelluricsWL: use wavelength calibration provided by the tellurics (default==True)
     barycentric: compute barycentric velocities (default=False)
+    memmap: memory map the file (default=False), only columns actually used are
+        read. Useful for large files with many unused columns.
+    dtype: floating point type of the spatial frequencies u/wl, v/wl, B/wl
+        (and PA, Bmax/wl, Bavg/wl). Default is np.float64, np.float32 halves
+        the memory footprint of these tables.
 
     """
     if debug:
@@ -83,7 +89,7 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
                          medFilt=medFilt, tellurics=tellurics, targname=targname,
                          verbose=verbose, debug=debug, binning=binning,
                          useTelluricsWL=useTelluricsWL, barycentric=barycentric,
-                         wlOffset=wlOffset)
+                         wlOffset=wlOffset, memmap=memmap, dtype=dtype)
             if type(tmp)==list:
                 res.extend(tmp)
             elif type(tmp)==dict:
@@ -94,36 +100,43 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
     # -- memmap=False assumes files are small so all is leaded at once
     # -- memmap=True (default) is bad if one reopen the file multiple times!
     # see https://docs.astropy.org/en/stable/io/fits/index.html#working-with-large-files
-    h = fits.open(filename, memmap=False)
+    # -- with memmap=True, nothing kept in "res" should be a view on the file
+    h = fits.open(filename, memmap=memmap)
 
     # -- how many instruments?
     instruments = []
     ins2targ = {}
-    for hdu in h:
+    # -- HDUs sorted by EXTNAME, to avoid going through the whole file again
+    hdus = {}
+    for ih, hdu in enumerate(h):
+        if 'EXTNAME' in hdu.header:
+            if not hdu.header['EXTNAME'] in hdus:
+                hdus[hdu.header['EXTNAME']] = []
+            hdus[hdu.header['EXTNAME']].append((ih, hdu))
         if 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='OI_WAVELENGTH':
             instruments.append(hdu.header['INSNAME'])
         if 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='OI_TARGET':
-            targets = {hdu.data['TARGET'][i].strip():hdu.data['TARGET_ID'][i] for
-                        i in range(len(hdu.data['TARGET']))}
+            # -- columns are read once
+            target, targetId = hdu.data['TARGET'], hdu.data['TARGET_ID']
             # -- weird case when targets is defined multiple times
             targets = {}
-            for i in range(len(hdu.data['TARGET'])):
-                k = hdu.data['TARGET'][i].strip()
+            for i in range(len(target)):
+                k = target[i].strip()
                 if not k in targets:
-                    targets[k] = hdu.data['TARGET_ID'][i]
+                    targets[k] = targetId[i]
                 else:
                     if type(targets[k])!=list:
-                        targets[k] = [targets[k], hdu.data['TARGET_ID'][i]]
+                        targets[k] = [targets[k], targetId[i]]
                     else:
-                        targets[k].append(hdu.data['TARGET_ID'][i])
+                        targets[k].append(targetId[i])
         if 'INSNAME' in hdu.header and 'XTENSION' in hdu.header and\
             hdu.header['XTENSION'].strip()=='BINTABLE':
             if 'TARGET_ID' in hdu.data.columns.names:
-                if not hdu.header['INSNAME'] in ins2targ:
-                    ins2targ[hdu.header['INSNAME']] = set(hdu.data['TARGET_ID'])
+                _ins = hdu.header['INSNAME']
+                if not _ins in ins2targ:
+                    ins2targ[_ins] = set(hdu.data['TARGET_ID'])
                 else:
-                    ins2targ[hdu.header['INSNAME']] = set(list(ins2targ[hdu.header['INSNAME']])+
-                                                          list(hdu.data['TARGET_ID']))
+                    ins2targ[_ins].update(hdu.data['TARGET_ID'])
     # -- keep only targets for the instrument, if specified
     if not insname is None and insname in ins2targ:
         try:
@@ -146,7 +159,8 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
             return [loadOI(filename, insname=ins, withHeader=withHeader,
                            verbose=verbose, medFilt=medFilt,
                            useTelluricsWL=useTelluricsWL,
-                           barycentric=barycentric) for ins in instruments]
+                           barycentric=barycentric, memmap=memmap,
+                           dtype=dtype) for ins in instruments]
 
     assert insname in instruments, 'unknown instrument "'+insname+'", '+\
         'should be in ['+', '.join(['"'+t+'"' for t in instruments])+']'
@@ -191,21 +205,21 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
         P = h[0].header['ESO ISS AMBI PRES'] # pressure in mbar
         H = h[0].header['ESO ISS AMBI RHUM'] # relative humidity: TODO outside == inside probably no ;(
         #print('T(C), P(mbar), H(%)', T, P, H)
-        res['n_lab'] = n_JHK(res['WL'].astype(np.float64), 273.15+T, P, H)
+        # -- n_lab is computed once the final wavelength table is known
+        _TPH = (273.15+T, P, H)
     except:
-        pass
+        _TPH = None
 
     # -- wavelength
-    for hdu in h:
-        if 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='OI_WAVELENGTH' and\
-            hdu.header['INSNAME']==insname:
+    for ih, hdu in hdus.get('OI_WAVELENGTH', []):
+        if hdu.header['INSNAME']==insname:
             # -- OIFITS in m, here we want um
             res['WL'] = np.array(hdu.data['EFF_WAVE'], dtype=np.float64)*1e6 + wlOffset
             res['dWL'] = np.array(hdu.data['EFF_BAND'], dtype=np.float64)*1e6
             if not binning is None:
                 # -- keep track of true wavelength
-                _WL = res['WL']*1.0
-                _dWL = res['dWL']*1.0
+                _WL = res['WL'].copy()
+                _dWL = res['dWL'].copy()
                 # -- binned
                 res['WL'] = np.linspace(res['WL'].min(),
                                         res['WL'].max(),
@@ -220,11 +234,10 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
 
     oiarrays = {}
     # -- build OI_ARRAY dictionnary to name the baselines
-    for ih, hdu in enumerate(h):
-        if 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='OI_ARRAY':
-            arrname = hdu.header['ARRNAME'].strip()
-            oiarrays[arrname] = dict(zip(hdu.data['STA_INDEX'],
-                                         np.char.strip(hdu.data['STA_NAME'])))
+    for ih, hdu in hdus.get('OI_ARRAY', []):
+        arrname = hdu.header['ARRNAME'].strip()
+        oiarrays[arrname] = dict(zip(hdu.data['STA_INDEX'],
+                                     np.char.strip(hdu.data['STA_NAME'])))
     if oiarrays=={}:
         if 'TELESCOP' in h[0].header and h[0].header['TELESCOP']=='VLTI':
             print('  > \033[33mWarning: no OI_ARRAY extension, guessing from header (VLTI)\033[0m')
@@ -248,33 +261,41 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
     res['OI_T3'] = {}
     res['OI_FLUX'] = {}
     res['OI_CF'] = {}
+    # -- baselines can be spread over several HDUs: data are collected as lists
+    # -- of arrays and concatenated once all HDUs have been read
+    chunks = {'OI_VIS2':{}, 'OI_VIS':{}, 'OI_CF':{}}
     ignoredTellurics = False
-    for ih, hdu in enumerate(h):
+    # -- keep the order of the file
+    for ih, hdu in sorted(sum([hdus.get(e, []) for e in
+                               ['TELLURICS', 'OI_FLUX', 'OI_VIS2', 'OI_VIS']], []),
+                          key=lambda x: x[0]):
         if 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='TELLURICS':
             if not tellurics is False:
-                if not binning is None and len(hdu.data['TELL_TRANS'])==len(_WL):
-                    if useTelluricsWL and 'CORR_WAVE' in [c.name for c in hdu.data.columns]:
+                # -- columns are read once
+                tell, cols = hdu.data['TELL_TRANS'], hdu.data.columns.names
+                if not binning is None and len(tell)==len(_WL):
+                    if useTelluricsWL and 'CORR_WAVE' in cols:
                         # -- corrected wavelength
-                        res['WL'] = hdu.data['CORR_WAVE']*1e6
+                        res['WL'] = np.array(hdu.data['CORR_WAVE'], dtype=np.float64)*1e6
                         if not binning is None:
                             # -- keep track of true wavelength
-                            _WL = res['WL']*1.0
+                            _WL = res['WL'].copy()
                             # -- binned
                             res['WL'] = np.linspace(res['WL'].min(),
                                                     res['WL'].max(),
                                                     len(res['WL'])//binning)
 
                     res['TELLURICS'] = binOI(res['WL'], _WL,
-                                             np.array([hdu.data['TELL_TRANS']]),
-                                             np.array([hdu.data['TELL_TRANS']<0]),
+                                             np.array([tell]),
+                                             np.array([tell<0]),
                                              medFilt=medFilt,
                                              retFlag=False)[0]
                     res['PWV'] = hdu.header['PWV']
-                elif len(hdu.data['TELL_TRANS'])==len(res['WL']):
-                    res['TELLURICS'] = hdu.data['TELL_TRANS']
-                    if useTelluricsWL and 'CORR_WAVE' in [c.name for c in hdu.data.columns]:
+                elif len(tell)==len(res['WL']):
+                    res['TELLURICS'] = np.array(tell)
+                    if useTelluricsWL and 'CORR_WAVE' in cols:
                         # -- corrected wavelength
-                        res['WL'] = hdu.data['CORR_WAVE']*1e6
+                        res['WL'] = np.array(hdu.data['CORR_WAVE'], dtype=np.float64)*1e6
 
                     res['PWV'] = hdu.header['PWV']
             else:
@@ -282,42 +303,35 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
 
         if 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='OI_FLUX' and\
                     hdu.header['INSNAME']==insname:
-            w = wTarg(hdu, targname, targets)
-            if not any(w):
+            wt = wTarg(hdu, targname, targets)
+            if not any(wt):
                 print('  > \033[33mWARNING\033[0m: no data in OI_FLUX [HDU #%d]  for target="%s"/target_id='%(
                       ih, targname), targets[targname])
                 continue
             try:
                 oiarray = oiarrays[hdu.header['ARRNAME'].strip()]
-                sta1 = [oiarray[s] for s in hdu.data['STA_INDEX']]
+                sta1 = _staNames(oiarray, hdu.data['STA_INDEX'])
             except:
-                sta1 = ['STA'+str(s) for s in hdu.data['STA_INDEX']]
-            for k in set(sta1):
-                # --
-                w = (np.array(sta1)==k)*wTarg(hdu, targname, targets)
-                try:
-                    # GRAVITY Data have non-standard naming :(
-                    res['OI_FLUX'][k] = {'FLUX':hdu.data['FLUX'][w].reshape(w.sum(), -1),
-                                        'EFLUX':hdu.data['FLUXERR'][w].reshape(w.sum(), -1),
-                                        'FLAG':hdu.data['FLAG'][w].reshape(w.sum(), -1),
-                                        'MJD':hdu.data['MJD'][w],
-                                        'MJD2':hdu.data['MJD'][w][:,None]+0*res['WL'][None,:],
-
-                                         }
-
-                except:
-                    res['OI_FLUX'][k] = {'FLUX':hdu.data['FLUXDATA'][w].reshape(w.sum(), -1),
-                                        'EFLUX':hdu.data['FLUXERR'][w].reshape(w.sum(), -1),
-                                        'FLAG':hdu.data['FLAG'][w].reshape(w.sum(), -1),
-                                        'MJD':hdu.data['MJD'][w],
-                                        'MJD2':hdu.data['MJD'][w][:,None]+0*res['WL'][None,:],
-                                         }
-
-                if any(w):
-                    res['OI_FLUX'][k]['FLAG'] = np.logical_or(res['OI_FLUX'][k]['FLAG'],
-                                                              ~np.isfinite(res['OI_FLUX'][k]['FLUX']))
-                    res['OI_FLUX'][k]['FLAG'] = np.logical_or(res['OI_FLUX'][k]['FLAG'],
-                                                              ~np.isfinite(res['OI_FLUX'][k]['EFLUX']))
+                sta1 = _staNames(None, hdu.data['STA_INDEX'])
+            try:
+                # GRAVITY Data have non-standard naming :(
+                flux = hdu.data['FLUX']
+            except:
+                flux = hdu.data['FLUXDATA']
+            eflux, flagdat, mjd = hdu.data['FLUXERR'], hdu.data['FLAG'], hdu.data['MJD']
+            for k, w in _groupRows(sta1, wt):
+                # -- w: indices of the rows for this telescope
+                res['OI_FLUX'][k] = {'FLUX':flux[w].reshape(len(w), -1),
+                                    'EFLUX':eflux[w].reshape(len(w), -1),
+                                    'FLAG':flagdat[w].reshape(len(w), -1),
+                                    'MJD':mjd[w],
+                                     }
+                res['OI_FLUX'][k]['MJD2'] = np.repeat(res['OI_FLUX'][k]['MJD'][:,None], len(res['WL']), axis=1)
+
+                if len(w):
+                    # -- flag non-finite data and errors, in place
+                    res['OI_FLUX'][k]['FLAG'] |= ~(np.isfinite(res['OI_FLUX'][k]['FLUX'])&
+                                                   np.isfinite(res['OI_FLUX'][k]['EFLUX']))
                     if not binning is None:
                         # -- Note the binning of flux is not weighted, because
                         # -- it would make the tellurics correction incorrect
@@ -341,104 +355,70 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
         elif 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='OI_VIS2' and\
                     hdu.header['INSNAME']==insname:
             #w = hdu.data['TARGET_ID']==targets[targname]
-            w = wTarg(hdu, targname, targets)
+            wt = wTarg(hdu, targname, targets)
 
-            if not any(w):
+            if not any(wt):
                 print('  > \033[33mWARNING\033[0m: no data in OI_VIS2 [HDU #%d]  for target="%s"/target_id='%(
                             ih, targname), targets[targname])
                 continue
             try:
                 oiarray = oiarrays[hdu.header['ARRNAME'].strip()]
-                sta2 = [oiarray[s[0]]+oiarray[s[1]] for s in hdu.data['STA_INDEX']]
+                sta2 = _staNames(oiarray, hdu.data['STA_INDEX'])
             except:
-                sta2 = ['STA'+str(s[0])+'STA'+str(s[1]) for s in hdu.data['STA_INDEX']]
+                sta2 = _staNames(None, hdu.data['STA_INDEX'])
+            # -- columns are read once for all baselines
+            ucoord, vcoord = hdu.data['UCOORD'], hdu.data['VCOORD']
+            mjd, flagdat = hdu.data['MJD'], hdu.data['FLAG']
+            v2, ev2 = hdu.data['VIS2DATA'], hdu.data['VIS2ERR']
+            # -- spatial frequencies, for all rows at once
+            invWL = (1/res['WL']).astype(dtype)
+            uwl = ucoord.astype(dtype)[:,None]*invWL[None,:]
+            vwl = vcoord.astype(dtype)[:,None]*invWL[None,:]
+            bwl = np.hypot(uwl, vwl)
 
             #print('     sta2:', sta2)
             if debug:
                 print('DEBUG: loading OI_VIS2', set(sta2))
-            for k in set(sta2):
-                w = (np.array(sta2)==k)*wTarg(hdu, targname, targets)
+            for k, w in _groupRows(sta2, wt):
+                # -- w: indices of the rows for this baseline
                 if debug:
                    print(' | ', k, w)
-                if k in res['OI_VIS2'] and any(w):
-                    for k1, k2 in [('V2', 'VIS2DATA'), ('EV2', 'VIS2ERR'), ('FLAG', 'FLAG')]:
-                        res['OI_VIS2'][k][k1] = np.append(res['OI_VIS2'][k][k1],
-                                                          hdu.data[k2][w].reshape(w.sum(), -1), axis=0)
-                    for k1, k2 in [('u', 'UCOORD'), ('v', 'VCOORD'), ('MJD','MJD')]:
-                        res['OI_VIS2'][k][k1] = np.append(res['OI_VIS2'][k][k1],
-                                                          hdu.data[k2][w])
-                    tmp = hdu.data['UCOORD'][w][:,None]/res['WL'][None,:]
-                    res['OI_VIS2'][k]['u/wl'] = np.append(res['OI_VIS2'][k]['u/wl'],
-                                                          tmp, axis=0)
-
-                    tmp = hdu.data['VCOORD'][w][:,None]/res['WL'][None,:]
-                    res['OI_VIS2'][k]['v/wl'] = np.append(res['OI_VIS2'][k]['v/wl'],
-                                                            tmp, axis=0)
-                    res['OI_VIS2'][k]['FLAG'] = np.logical_or(res['OI_VIS2'][k]['FLAG'],
-                                                              ~np.isfinite(res['OI_VIS2'][k]['V2']))
-                    res['OI_VIS2'][k]['FLAG'] = np.logical_or(res['OI_VIS2'][k]['FLAG'],
-                                                              ~np.isfinite(res['OI_VIS2'][k]['EV2']))
-                    res['OI_VIS2'][k]['MJD2'] = res['OI_VIS2'][k]['MJD'][:,None]+0*res['WL'][None,:]
-                elif any(w):
-                    res['OI_VIS2'][k] = {'V2':hdu.data['VIS2DATA'][w].reshape(w.sum(), -1),
-                                         'EV2':hdu.data['VIS2ERR'][w].reshape(w.sum(), -1),
-                                         'u':hdu.data['UCOORD'][w],
-                                         'v':hdu.data['VCOORD'][w],
-                                         'MJD':hdu.data['MJD'][w],
-                                         'MJD2':hdu.data['MJD'][w][:,None]+0*res['WL'][None,:],
-                                         'u/wl': hdu.data['UCOORD'][w][:,None]/
-                                                res['WL'][None,:],
-                                         'v/wl': hdu.data['VCOORD'][w][:,None]/
-                                                res['WL'][None,:],
-                                         'FLAG':hdu.data['FLAG'][w].reshape(w.sum(), -1)
-                                        }
-                    res['OI_VIS2'][k]['FLAG'] = np.logical_or(res['OI_VIS2'][k]['FLAG'],
-                                                              ~np.isfinite(res['OI_VIS2'][k]['V2']))
-                    res['OI_VIS2'][k]['FLAG'] = np.logical_or(res['OI_VIS2'][k]['FLAG'],
-                                                              ~np.isfinite(res['OI_VIS2'][k]['EV2']))
-                if any(w):
-                    res['OI_VIS2'][k]['B/wl'] = np.sqrt(res['OI_VIS2'][k]['u/wl']**2+
-                                                        res['OI_VIS2'][k]['v/wl']**2)
-                    res['OI_VIS2'][k]['PA'] = np.angle(res['OI_VIS2'][k]['v/wl']+
-                                                    1j*res['OI_VIS2'][k]['u/wl'], deg=True)
-                    if not binning is None:
-                        res['OI_VIS2'][k]['V2'], flag =\
-                                                   binOI(res['WL'], _WL,
-                                                         res['OI_VIS2'][k]['V2'],
-                                                         res['OI_VIS2'][k]['FLAG'],
-                                                         res['OI_VIS2'][k]['EV2'],
-                                                         medFilt=medFilt,
-                                                         retFlag=True)
-
-                        # -- KLUDGE!
-                        # res['OI_VIS2'][k]['EV2'] = binOI(res['WL'], _WL,
-                        #                                  res['OI_VIS2'][k]['EV2'],
-                        #                                  res['OI_VIS2'][k]['FLAG'],
-                        #                                  res['OI_VIS2'][k]['EV2'],
-                        #                                  medFilt=medFilt)
-                        res['OI_VIS2'][k]['EV2'] = 1/binOI(res['WL'], _WL,
-                                                         1/res['OI_VIS2'][k]['EV2'],
-                                                         res['OI_VIS2'][k]['FLAG'],
-                                                         res['OI_VIS2'][k]['EV2'],
-                                                         medFilt=medFilt)
-                        
-                        res['OI_VIS2'][k]['FLAG'] = flag
+                if not len(w):
+                    continue
+                _2d = [('V2', v2), ('EV2', ev2), ('FLAG', flagdat),
+                       ('u/wl', uwl), ('v/wl', vwl), ('B/wl', bwl)]
+                _1d = [('u', ucoord), ('v', vcoord), ('MJD', mjd)]
+                if not k in chunks['OI_VIS2']:
+                    chunks['OI_VIS2'][k] = {k1:[] for k1, x in _2d+_1d}
+                for k1, x in _2d:
+                    chunks['OI_VIS2'][k][k1].append(x[w].reshape(len(w), -1))
+                for k1, x in _1d:
+                    chunks['OI_VIS2'][k][k1].append(x[w])
 
         # -- V baselines == telescopes pairs
         elif 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='OI_VIS' and\
                     hdu.header['INSNAME']==insname:
             #w = hdu.data['TARGET_ID']==targets[targname]
-            w = wTarg(hdu, targname, targets)
-            if not any(w):
+            wt = wTarg(hdu, targname, targets)
+            if not any(wt):
                 print('  > \033[33mWARNING\033[0m: no data in OI_VIS [HDU #%d]  for target="%s"/target_id='%(
                             ih, targname), targets[targname])
                 continue
             try:
                 oiarray = oiarrays[hdu.header['ARRNAME'].strip()]
-                sta2 = [oiarray[s[0]]+oiarray[s[1]] for s in hdu.data['STA_INDEX']]
+                sta2 = _staNames(oiarray, hdu.data['STA_INDEX'])
             except:
-                sta2 = ['STA'+str(s[0])+'STA'+str(s[1]) for s in hdu.data['STA_INDEX']]
-
+                sta2 = _staNames(None, hdu.data['STA_INDEX'])
+            # -- columns are read once for all baselines
+            ucoord, vcoord = hdu.data['UCOORD'], hdu.data['VCOORD']
+            mjd, flagdat = hdu.data['MJD'], hdu.data['FLAG']
+            visamp, evisamp = hdu.data['VISAMP'], hdu.data['VISAMPERR']
+            visphi, evisphi = hdu.data['VISPHI'], hdu.data['VISPHIERR']
+            # -- spatial frequencies, for all rows at once
+            invWL = (1/res['WL']).astype(dtype)
+            uwl = ucoord.astype(dtype)[:,None]*invWL[None,:]
+            vwl = vcoord.astype(dtype)[:,None]*invWL[None,:]
+            bwl = np.hypot(uwl, vwl)
 
             if 'AMPTYP' in hdu.header and hdu.header['AMPTYP'] == 'correlated flux':
                 ext = 'OI_CF'
@@ -470,99 +450,72 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
             else:
                 res['units']={'PHI':_unit}
 
-            for k in set(sta2):
-                w = (np.array(sta2)==k)*wTarg(hdu, targname, targets)
+            for k, w in _groupRows(sta2, wt):
+                # -- w: indices of the rows for this baseline
                 # if debug:
                 #    print(' | ', k, any(w))
-                if k in res[ext] and any(w):
-                    for k1, k2 in [(vis, 'VISAMP'), ('E'+vis, 'VISAMPERR'),
-                                    ('PHI', 'VISPHI'), ('EPHI', 'VISPHIERR'),
-                                    ('FLAG', 'FLAG')]:
-                        res[ext][k][k1] = np.append(res[ext][k][k1],
-                                                         hdu.data[k2][w].reshape(w.sum(), -1), axis=0)
-                    for k1, k2 in [('u', 'UCOORD'), ('v', 'VCOORD'), ('MJD', 'MJD')]:
-                        res[ext][k][k1] = np.append(res[ext][k][k1],
-                                                          hdu.data[k2][w])
-                    tmp = hdu.data['UCOORD'][w][:,None]/res['WL'][None,:]
-                    res[ext][k]['u/wl'] = np.append(res[ext][k]['u/wl'],
-                                                         tmp, axis=0)
-                    tmp = hdu.data['VCOORD'][w][:,None]/res['WL'][None,:]
-                    res[ext][k]['v/wl'] = np.append(res[ext][k]['v/wl'],
-                                                         tmp, axis=0)
-                    res[ext][k]['FLAG'] = np.logical_or(res[ext][k]['FLAG'],
-                                                             ~np.isfinite(res[ext][k][vis]))
-                    res[ext][k]['FLAG'] = np.logical_or(res[ext][k]['FLAG'],
-                                                             ~np.isfinite(res[ext][k]['E'+vis]))
-
-                elif any(w):
-                    res[ext][k] = {vis:hdu.data['VISAMP'][w].reshape(w.sum(), -1),
-                                        'E'+vis:hdu.data['VISAMPERR'][w].reshape(w.sum(), -1),
-                                        'PHI':hdu.data['VISPHI'][w].reshape(w.sum(), -1),
-                                        'EPHI':hdu.data['VISPHIERR'][w].reshape(w.sum(), -1),
-                                        'MJD':hdu.data['MJD'][w],
-                                        'MJD2':hdu.data['MJD'][w][:,None]+0*res['WL'][None,:],
-                                        'u':hdu.data['UCOORD'][w],
-                                        'v':hdu.data['VCOORD'][w],
-                                        'u/wl': hdu.data['UCOORD'][w][:,None]/
-                                               res['WL'][None,:],
-                                        'v/wl': hdu.data['VCOORD'][w][:,None]/
-                                               res['WL'][None,:],
-                                        'FLAG':hdu.data['FLAG'][w].reshape(w.sum(), -1)
-                                        }
-                if any(w):
-                    res[ext][k]['B/wl'] = np.sqrt(res[ext][k]['u/wl']**2+
-                                                       res[ext][k]['v/wl']**2)
-                    res[ext][k]['PA'] = np.angle(res[ext][k]['v/wl']+
-                                                   1j*res[ext][k]['u/wl'], deg=True)
-
-                    res[ext][k]['FLAG'] = np.logical_or(res[ext][k]['FLAG'],
-                                                             ~np.isfinite(res[ext][k][vis]))
-                    res[ext][k]['FLAG'] = np.logical_or(res[ext][k]['FLAG'],
-                                                              ~np.isfinite(res[ext][k]['E'+vis]))
-
-                    if not binning is None:
-                        _w = ~res[ext][k]['FLAG']
-                        res[ext][k][vis],  flag = binOI(res['WL'], _WL,
-                                                         res[ext][k][vis],
-                                                         res[ext][k]['FLAG'],
-                                                         res[ext][k]['E'+vis],
-                                                         medFilt=medFilt,
-                                                         retFlag=True)
-                        res[ext][k]['PHI'] = binOI(res['WL'], _WL,
-                                                         res[ext][k]['PHI'],
-                                                         res[ext][k]['FLAG'],
-                                                         res[ext][k]['EPHI'],
-                                                         medFilt=medFilt)
-
-                        # -- KLUDGE!
-                        # res[ext][k]['E'+vis] = binOI(res['WL'], _WL,
-                        #                                  res[ext][k]['E'+vis],
-                        #                                  res[ext][k]['FLAG'],
-                        #                                  res[ext][k]['E|V|'],
-                        #                                  medFilt=medFilt)
-                        # res[ext][k]['EPHI'] = binOI(res['WL'], _WL,
-                        #                                  res[ext][k]['EPHI'],
-                        #                                  res[ext][k]['FLAG'],
-                        #                                  res[ext][k]['EPHI'],
-                        #                                  medFilt=medFilt)
-                        res[ext][k]['E'+vis] = 1/binOI(res['WL'], _WL,
-                                                         1/res[ext][k]['E'+vis],
-                                                         res[ext][k]['FLAG'],
-                                                         res[ext][k]['E'+vis],
-                                                         medFilt=medFilt)
-                        res[ext][k]['EPHI'] = 1/binOI(res['WL'], _WL,
-                                                         1/res[ext][k]['EPHI'],
-                                                         res[ext][k]['FLAG'],
-                                                         res[ext][k]['EPHI'],
-                                                         medFilt=medFilt)
-                        
-                        res[ext][k]['FLAG'] = flag
+                if not len(w):
+                    continue
+                _2d = [(vis, visamp), ('E'+vis, evisamp),
+                       ('PHI', visphi), ('EPHI', evisphi), ('FLAG', flagdat),
+                       ('u/wl', uwl), ('v/wl', vwl), ('B/wl', bwl)]
+                _1d = [('u', ucoord), ('v', vcoord), ('MJD', mjd)]
+                if not k in chunks[ext]:
+                    chunks[ext][k] = {k1:[] for k1, x in _2d+_1d}
+                for k1, x in _2d:
+                    chunks[ext][k][k1].append(x[w].reshape(len(w), -1))
+                for k1, x in _1d:
+                    chunks[ext][k][k1].append(x[w])
 
         #elif debug and 'EXTNAME' in hdu.header:
         #    print('DEBUG:', hdu.header['EXTNAME'])
         #elif debug:
         #    print('DEBUG: skipping HDU')
 
+    for ext in chunks:
+        vis = {'OI_VIS2':'V2', 'OI_VIS':'|V|', 'OI_CF':'CF'}[ext]
+        for k in chunks[ext]:
+            res[ext][k] = {k1:np.concatenate(chunks[ext][k][k1], axis=0)
+                            for k1 in chunks[ext][k]}
+            res[ext][k]['MJD2'] = np.repeat(res[ext][k]['MJD'][:,None], len(res['WL']), axis=1)
+            # -- flag non-finite data and errors, in place
+            res[ext][k]['FLAG'] |= ~(np.isfinite(res[ext][k][vis])&
+                                     np.isfinite(res[ext][k]['E'+vis]))
+            # -- same as np.angle(v/wl+1j*u/wl, deg=True), without complex temporary
+            res[ext][k]['PA'] = np.arctan2(res[ext][k]['u/wl'], res[ext][k]['v/wl'])
+            res[ext][k]['PA'] *= 180/np.pi
+            if not binning is None:
+                res[ext][k][vis], flag = binOI(res['WL'], _WL,
+                                               res[ext][k][vis],
+                                               res[ext][k]['FLAG'],
+                                               res[ext][k]['E'+vis],
+                                               medFilt=medFilt,
+                                               retFlag=True)
+                if 'PHI' in res[ext][k]:
+                    res[ext][k]['PHI'] = binOI(res['WL'], _WL,
+                                               res[ext][k]['PHI'],
+                                               res[ext][k]['FLAG'],
+                                               res[ext][k]['EPHI'],
+                                               medFilt=medFilt)
+                # -- KLUDGE!
+                # res[ext][k]['E'+vis] = binOI(res['WL'], _WL,
+                #                              res[ext][k]['E'+vis],
+                #                              res[ext][k]['FLAG'],
+                #                              res[ext][k]['E'+vis],
+                #                              medFilt=medFilt)
+                res[ext][k]['E'+vis] = 1/binOI(res['WL'], _WL,
+                                               1/res[ext][k]['E'+vis],
+                                               res[ext][k]['FLAG'],
+                                               res[ext][k]['E'+vis],
+                                               medFilt=medFilt)
+                if 'EPHI' in res[ext][k]:
+                    res[ext][k]['EPHI'] = 1/binOI(res['WL'], _WL,
+                                                  1/res[ext][k]['EPHI'],
+                                                  res[ext][k]['FLAG'],
+                                                  res[ext][k]['EPHI'],
+                                                  medFilt=medFilt)
+                res[ext][k]['FLAG'] = flag
+
     if res['OI_CF'] == {}:
         res.pop('OI_CF')
 
@@ -577,25 +530,32 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
     if debug:
         print('-'*60)
 
-    sta2 = list(set(sta2))
+    # -- sets: membership tests in the triangle lookup below are done a lot
+    sta2 = set(sta2)
 
     M = [] # missing baselines in T3
-    for ih, hdu in enumerate(h):
-        if 'EXTNAME' in hdu.header and hdu.header['EXTNAME']=='OI_T3' and\
-                    hdu.header['INSNAME']==insname:
+    _M = set() # same as M, for fast lookup
+    chunks['OI_T3'], formula = {}, {}
+    for ih, hdu in hdus.get('OI_T3', []):
+        if hdu.header['INSNAME']==insname:
             #w = hdu.data['TARGET_ID']==targets[targname]
-            w = wTarg(hdu, targname, targets)
-            if not any(w):
+            wt = wTarg(hdu, targname, targets)
+            if not any(wt):
                 print('  > \033[33mWARNING\033[0m: no data in OI_T3 [HDU #%d]  for target="%s"/target_id='%(
                             ih, targname), targets[targname])
                 continue
             # -- T3 baselines == telescopes pairs
             try:
                 oiarray = oiarrays[hdu.header['ARRNAME'].strip()]
-                sta3 = [oiarray[s[0]]+oiarray[s[1]]+oiarray[s[2]] for s in hdu.data['STA_INDEX']]
+                sta3 = _staNames(oiarray, hdu.data['STA_INDEX'])
             except:
-                sta3 = ['STA'+str(s[0])+'STA'+str(s[1])+'STA'+str(s[2]) 
-                        for s in hdu.data['STA_INDEX']]
+                sta3 = _staNames(None, hdu.data['STA_INDEX'])
+            # -- columns are read once for all triangles
+            u1coord, v1coord = hdu.data['U1COORD'], hdu.data['V1COORD']
+            u2coord, v2coord = hdu.data['U2COORD'], hdu.data['V2COORD']
+            mjd, flagdat = hdu.data['MJD'], hdu.data['FLAG']
+            t3amp, et3amp = hdu.data['T3AMP'], hdu.data['T3AMPERR']
+            t3phi, et3phi = hdu.data['T3PHI'], hdu.data['T3PHIERR']
 
             # -- limitation: assumes all telescope have same number of char!
             n = len(sta3[0])//3 # number of char per telescope
@@ -609,134 +569,122 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
             else:
                 res['units']={'T3PHI':_unit}
 
-            for k in set(sta3):
-                w = (np.array(sta3)==k)*wTarg(hdu, targname, targets)
+            for k, w in _groupRows(sta3, wt):
+                # -- w: indices of the rows for this triangle
                 # -- find triangles
                 t, s, m = [], [], []
                 # -- first baseline
-                if k[:2*n] in sta2 or k[:2*n] in M:
+                if k[:2*n] in sta2 or k[:2*n] in _M:
                     t.append(k[:2*n])
                     s.append(1)
-                elif k[n:2*n]+k[:n] in sta2 or k[:2*n] in M:
+                elif k[n:2*n]+k[:n] in sta2 or k[:2*n] in _M:
                     t.append(k[n:2*n]+k[:n])
                     s.append(-1)
                 else:
                     t.append(k[:2*n])
                     s.append(1)
                     M.append(k[:2*n])
+                    _M.add(k[:2*n])
 
                 # -- second baseline
-                if k[n:] in sta2 or k[n:] in M:
+                if k[n:] in sta2 or k[n:] in _M:
                     t.append(k[n:])
                     s.append(1)
-                elif k[2*n:3*n]+k[n:2*n] in sta2 or k[2*n:3*n]+k[n:2*n] in M:
+                elif k[2*n:3*n]+k[n:2*n] in sta2 or k[2*n:3*n]+k[n:2*n] in _M:
                     t.append(k[2*n:3*n]+k[n:2*n])
                     s.append(-1)
                 else:
                     t.append(k[n:])
                     s.append(1)
                     M.append(k[n:])
+                    _M.add(k[n:])
 
                 # -- third baseline
-                if k[2*n:3*n]+k[:n] in sta2 or k[2*n:3*n]+k[:n] in M:
+                if k[2*n:3*n]+k[:n] in sta2 or k[2*n:3*n]+k[:n] in _M:
                     t.append(k[2*n:3*n]+k[:n])
                     s.append(1)
-                elif k[:n]+k[2*n:3*n] in sta2 or k[:n]+k[2*n:3*n] in M:
+                elif k[:n]+k[2*n:3*n] in sta2 or k[:n]+k[2*n:3*n] in _M:
                     t.append(k[:n]+k[2*n:3*n])
                     s.append(-1)
                 else:
                     t.append(k[2*n:3*n]+k[:n])
                     s.append(1)
                     M.append(k[2*n:3*n]+k[:n])
-
-                if k in res['OI_T3'] and any(w):
-                    for k1, k2 in [('T3AMP', 'T3AMP'), ('ET3AMP', 'T3AMPERR'),
-                                    ('T3PHI', 'T3PHI'), ('ET3PHI', 'T3PHIERR'),
-                                    ('FLAG', 'FLAG')]:
-                        res['OI_T3'][k][k1] = np.append(res['OI_T3'][k][k1],
-                                                        hdu.data[k2][w].reshape(w.sum(), -1), axis=0)
-                    for k1, k2 in [('u1', 'U1COORD'), ('u2', 'U2COORD'),
-                                   ('v1', 'V1COORD'), ('v2', 'V2COORD'),
-                                   ('MJD', 'MJD')]:
-                        res['OI_T3'][k][k1] = np.append(res['OI_T3'][k][k1],
-                                                         hdu.data[k2][w])
-                    res['OI_T3'][k]['FLAG'] = np.logical_or(res['OI_T3'][k]['FLAG'],
-                                                            ~np.isfinite(res['OI_T3'][k]['T3AMP']))
-                    res['OI_T3'][k]['FLAG'] = np.logical_or(res['OI_T3'][k]['FLAG'],
-                                                            ~np.isfinite(res['OI_T3'][k]['ET3AMP']))
-                    res['OI_T3'][k]['MJD2'] = res['OI_T3'][k]['MJD'][:,None] + 0*res['WL'][None,:]
-
-                elif any(w):
-                    res['OI_T3'][k] = {'T3AMP':hdu.data['T3AMP'][w].reshape(w.sum(), -1),
-                                       'ET3AMP':hdu.data['T3AMPERR'][w].reshape(w.sum(), -1),
-                                       'T3PHI':hdu.data['T3PHI'][w].reshape(w.sum(), -1),
-                                       'ET3PHI':hdu.data['T3PHIERR'][w].reshape(w.sum(), -1),
-                                       'MJD':hdu.data['MJD'][w],
-                                       'u1':hdu.data['U1COORD'][w],
-                                       'v1':hdu.data['V1COORD'][w],
-                                       'u2':hdu.data['U2COORD'][w],
-                                       'v2':hdu.data['V2COORD'][w],
-                                       'formula': (s, t),
-                                       'FLAG':hdu.data['FLAG'][w].reshape(w.sum(), -1)
-                                        }
-                if any(w):
-                    res['OI_T3'][k]['B1'] = np.sqrt(res['OI_T3'][k]['u1']**2+
-                                                    res['OI_T3'][k]['v1']**2)
-                    res['OI_T3'][k]['B2'] = np.sqrt(res['OI_T3'][k]['u2']**2+
-                                                    res['OI_T3'][k]['v2']**2)
-                    res['OI_T3'][k]['B3'] = np.sqrt((res['OI_T3'][k]['u1']+res['OI_T3'][k]['u2'])**2+
-                                                    (res['OI_T3'][k]['v1']+res['OI_T3'][k]['v2'])**2)
-                    bmax = np.maximum(res['OI_T3'][k]['B1'], res['OI_T3'][k]['B2'])
-                    bmax = np.maximum(res['OI_T3'][k]['B3'], bmax)
-                    bavg = (res['OI_T3'][k]['B1'] +
-                            res['OI_T3'][k]['B2'] +
-                            res['OI_T3'][k]['B3'])/3
-
-                    res['OI_T3'][k]['Bmax/wl'] = bmax[:,None]/res['WL'][None,:]
-                    res['OI_T3'][k]['Bavg/wl'] = bavg[:,None]/res['WL'][None,:]
-
-                    res['OI_T3'][k]['FLAG'] = np.logical_or(res['OI_T3'][k]['FLAG'],
-                                                            ~np.isfinite(res['OI_T3'][k]['T3AMP']))
-                    res['OI_T3'][k]['FLAG'] = np.logical_or(res['OI_T3'][k]['FLAG'],
-                                                            ~np.isfinite(res['OI_T3'][k]['ET3AMP']))
-                    if not binning is None:
-                        _w = ~res['OI_T3'][k]['FLAG']
-                        res['OI_T3'][k]['T3AMP'], flag = \
-                                                    binOI(res['WL'], _WL,
-                                                          res['OI_T3'][k]['T3AMP'],
-                                                          res['OI_T3'][k]['FLAG'],
-                                                          res['OI_T3'][k]['ET3AMP'],
-                                                          medFilt=medFilt,
-                                                          retFlag=True)
-                        res['OI_T3'][k]['T3PHI'] = binOI(res['WL'], _WL, 
-                                                         res['OI_T3'][k]['T3PHI'],
-                                                         res['OI_T3'][k]['FLAG'], 
-                                                         res['OI_T3'][k]['ET3PHI'],
-                                                         medFilt=medFilt, phase=True)
-                        # -- KLUDGE!
-                        # res['OI_T3'][k]['ET3AMP'] = binOI(res['WL'], _WL,
-                        #                                    res['OI_T3'][k]['ET3AMP'],
-                        #                                    res['OI_T3'][k]['FLAG'],
-                        #                                    res['OI_T3'][k]['ET3AMP'],
-                        #                                    medFilt=medFilt)
-                        # res['OI_T3'][k]['ET3PHI'] = binOI(res['WL'], _WL,
-                        #                                    res['OI_T3'][k]['ET3PHI'],
-                        #                                    res['OI_T3'][k]['FLAG'],
-                        #                                    res['OI_T3'][k]['ET3PHI'],
-                        #                                    medFilt=medFilt)
-                        res['OI_T3'][k]['ET3AMP'] = 1/binOI(res['WL'], _WL,
-                                                           1/res['OI_T3'][k]['ET3AMP'],
-                                                           res['OI_T3'][k]['FLAG'],
-                                                           res['OI_T3'][k]['ET3AMP'],
-                                                           medFilt=medFilt)
-                        res['OI_T3'][k]['ET3PHI'] = 1/binOI(res['WL'], _WL,
-                                                           1/res['OI_T3'][k]['ET3PHI'],
-                                                           res['OI_T3'][k]['FLAG'],
-                                                           res['OI_T3'][k]['ET3PHI'],
-                                                           medFilt=medFilt)
-                        
-                        res['OI_T3'][k]['FLAG'] = flag
-                res['OI_T3'][k]['MJD2'] = res['OI_T3'][k]['MJD'][:,None] + 0*res['WL'][None,:]
+                    _M.add(k[2*n:3*n]+k[:n])
+
+                if not len(w):
+                    continue
+                if not k in chunks['OI_T3']:
+                    chunks['OI_T3'][k] = {k1:[] for k1 in ['T3AMP', 'ET3AMP', 'T3PHI', 'ET3PHI',
+                                                            'FLAG', 'u1', 'u2', 'v1', 'v2', 'MJD']}
+                    formula[k] = (s, t)
+                for k1, x in [('T3AMP', t3amp), ('ET3AMP', et3amp),
+                               ('T3PHI', t3phi), ('ET3PHI', et3phi),
+                               ('FLAG', flagdat)]:
+                    chunks['OI_T3'][k][k1].append(x[w].reshape(len(w), -1))
+                for k1, x in [('u1', u1coord), ('u2', u2coord),
+                              ('v1', v1coord), ('v2', v2coord),
+                              ('MJD', mjd)]:
+                    chunks['OI_T3'][k][k1].append(x[w])
+
+    invWL = (1/res['WL']).astype(dtype)
+    for k in chunks['OI_T3']:
+        res['OI_T3'][k] = {k1:np.concatenate(chunks['OI_T3'][k][k1], axis=0)
+                           for k1 in chunks['OI_T3'][k]}
+        res['OI_T3'][k]['formula'] = formula[k]
+        res['OI_T3'][k]['B1'] = np.hypot(res['OI_T3'][k]['u1'], res['OI_T3'][k]['v1'])
+        res['OI_T3'][k]['B2'] = np.hypot(res['OI_T3'][k]['u2'], res['OI_T3'][k]['v2'])
+        res['OI_T3'][k]['B3'] = np.hypot(res['OI_T3'][k]['u1']+res['OI_T3'][k]['u2'],
+                                         res['OI_T3'][k]['v1']+res['OI_T3'][k]['v2'])
+        bmax = np.maximum(res['OI_T3'][k]['B1'], res['OI_T3'][k]['B2'])
+        bmax = np.maximum(res['OI_T3'][k]['B3'], bmax).astype(dtype)
+        bavg = (res['OI_T3'][k]['B1'] +
+                res['OI_T3'][k]['B2'] +
+                res['OI_T3'][k]['B3'])/3
+        bavg = bavg.astype(dtype)
+
+        res['OI_T3'][k]['Bmax/wl'] = bmax[:,None]*invWL[None,:]
+        res['OI_T3'][k]['Bavg/wl'] = bavg[:,None]*invWL[None,:]
+
+        # -- flag non-finite data and errors, in place
+        res['OI_T3'][k]['FLAG'] |= ~(np.isfinite(res['OI_T3'][k]['T3AMP'])&
+                                     np.isfinite(res['OI_T3'][k]['ET3AMP']))
+        if not binning is None:
+            res['OI_T3'][k]['T3AMP'], flag = \
+                                        binOI(res['WL'], _WL,
+                                              res['OI_T3'][k]['T3AMP'],
+                                              res['OI_T3'][k]['FLAG'],
+                                              res['OI_T3'][k]['ET3AMP'],
+                                              medFilt=medFilt,
+                                              retFlag=True)
+            res['OI_T3'][k]['T3PHI'] = binOI(res['WL'], _WL,
+                                             res['OI_T3'][k]['T3PHI'],
+                                             res['OI_T3'][k]['FLAG'],
+                                             res['OI_T3'][k]['ET3PHI'],
+                                             medFilt=medFilt, phase=True)
+            # -- KLUDGE!
+            # res['OI_T3'][k]['ET3AMP'] = binOI(res['WL'], _WL,
+            #                                    res['OI_T3'][k]['ET3AMP'],
+            #                                    res['OI_T3'][k]['FLAG'],
+            #                                    res['OI_T3'][k]['ET3AMP'],
+            #                                    medFilt=medFilt)
+            # res['OI_T3'][k]['ET3PHI'] = binOI(res['WL'], _WL,
+            #                                    res['OI_T3'][k]['ET3PHI'],
+            #                                    res['OI_T3'][k]['FLAG'],
+            #                                    res['OI_T3'][k]['ET3PHI'],
+            #                                    medFilt=medFilt)
+            res['OI_T3'][k]['ET3AMP'] = 1/binOI(res['WL'], _WL,
+                                               1/res['OI_T3'][k]['ET3AMP'],
+                                               res['OI_T3'][k]['FLAG'],
+                                               res['OI_T3'][k]['ET3AMP'],
+                                               medFilt=medFilt)
+            res['OI_T3'][k]['ET3PHI'] = 1/binOI(res['WL'], _WL,
+                                               1/res['OI_T3'][k]['ET3PHI'],
+                                               res['OI_T3'][k]['FLAG'],
+                                               res['OI_T3'][k]['ET3PHI'],
+                                               medFilt=medFilt)
+            res['OI_T3'][k]['FLAG'] = flag
+        res['OI_T3'][k]['MJD2'] = np.repeat(res['OI_T3'][k]['MJD'][:,None], len(res['WL']), axis=1)
 
     key = 'OI_VIS'
     if res['OI_VIS']=={} and res['OI_T3']=={}:
@@ -759,29 +707,32 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
         if len(M) and debug:
             print('    warning: \033[43mmissing baselines\033[0m', M, 'to define T3')
         # -- match MJDs for T3 computations:
+        WL = res['WL']
+        invWL = (1/WL).astype(dtype)
         for k in res['OI_T3'].keys():
-            s, t = res['OI_T3'][k]['formula']
-            w0, w1, w2 = [], [], []
+            T3 = res['OI_T3'][k]
+            s, t = T3['formula']
             if debug:
-                print('DEBUG: OI_T3', k, t, res['OI_T3'][k]['MJD'])
+                print('DEBUG: OI_T3', k, t, T3['MJD'])
                 #for i in range(3):
                 #    print(' VIS :', t[i], res['OI_VIS'][t[i]]['MJD'])
                 #    print(' VIS2:', t[i], res['OI_VIS'][t[i]]['MJD'])
 
             # -- add missing baselines
             A = {}
+            shape = (len(T3['MJD']), len(WL))
             for m in M:
                 if m in t:
                     # -- added sign on 2021/09/22
                     if t.index(m)==0:
-                        u = s[0]*res['OI_T3'][k]['u1']
-                        v = s[0]*res['OI_T3'][k]['v1']
+                        u = s[0]*T3['u1']
+                        v = s[0]*T3['v1']
                     elif t.index(m)==1:
-                        u = s[1]*res['OI_T3'][k]['u2']
-                        v = s[1]*res['OI_T3'][k]['v2']
+                        u = s[1]*T3['u2']
+                        v = s[1]*T3['v2']
                     elif t.index(m)==2:
-                        u = -s[2]*(res['OI_T3'][k]['u1']+res['OI_T3'][k]['u2'])
-                        v = -s[2]*(res['OI_T3'][k]['v1']+res['OI_T3'][k]['v2'])
+                        u = -s[2]*(T3['u1']+T3['u2'])
+                        v = -s[2]*(T3['v1']+T3['v2'])
                     # -- add data
                     tmp = {}
                     #if key=='OI_VIS':
@@ -790,19 +741,17 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
                     #    _K = ['V2']
                     _K = ['V2', '|V|', 'PHI']
                     for _k in _K:
-                        tmp[_k] = np.zeros((len(res['OI_T3'][k]['MJD']),
-                                              len(res['WL'])))
-                        tmp['E'+_k] = np.ones((len(res['OI_T3'][k]['MJD']),
-                                               len(res['WL'])))
+                        tmp[_k] = np.zeros(shape)
+                        tmp['E'+_k] = np.ones(shape)
                     tmp['u'], tmp['v'] = u, v
-                    tmp['u/wl'] = u[:,None]/res['WL'][None,:]
-                    tmp['v/wl'] = v[:,None]/res['WL'][None,:]
-                    tmp['B/wl'] = np.sqrt(tmp['u/wl']**2 + tmp['v/wl']**2)
-                    tmp['FLAG'] = np.ones((len(res['OI_T3'][k]['MJD']),
-                                           len(res['WL'])), dtype=bool)
-                    tmp['MJD'] = 1.0*res['OI_T3'][k]['MJD']
-                    tmp['MJD2'] = tmp['MJD'][:,None] + 0*res['WL'][None,:]
-                    tmp['PA'] = np.angle(tmp['v/wl']+1j*tmp['u/wl'], deg=True)
+                    tmp['u/wl'] = u.astype(dtype)[:,None]*invWL[None,:]
+                    tmp['v/wl'] = v.astype(dtype)[:,None]*invWL[None,:]
+                    tmp['B/wl'] = np.hypot(tmp['u/wl'], tmp['v/wl'])
+                    tmp['FLAG'] = np.ones(shape, dtype=bool)
+                    tmp['MJD'] = T3['MJD'].copy()
+                    tmp['MJD2'] = np.repeat(tmp['MJD'][:,None], len(WL), axis=1)
+                    tmp['PA'] = np.arctan2(tmp['u/wl'], tmp['v/wl'])
+                    tmp['PA'] *= 180/np.pi
                     A[m] = tmp
 
             if len(A):
@@ -822,164 +771,71 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
                     #print(m, 'VIS2', res['OI_VIS2'][m].keys())
                     M.remove(m)
 
-            for i, mjd in enumerate(res['OI_T3'][k]['MJD']):
-                # check data are within ~10s
-                if min(np.abs(res[key][t[0]]['MJD']-mjd))<1e-4:
-                    w0.append(np.argmin((res[key][t[0]]['MJD']-mjd)**2+
-                                        (res[key][t[0]]['u']-s[0]*res['OI_T3'][k]['u1'][i])**2+
-                                        (res[key][t[0]]['v']-s[0]*res['OI_T3'][k]['v1'][i])**2))
-
-                else:
-                    w0.append(len(res[key][t[0]]['MJD']))
-                    if debug:
-                        print('\033[43mWARNING\033[0m: missing MJD [0]', mjd, k, key, t[0])
-                    # -- add fake data for MJD
-                    for _key in ['OI_VIS', 'OI_VIS2']:
-                        res[_key][t[0]]['MJD'] = np.append(res[_key][t[0]]['MJD'], mjd)
-                        res[_key][t[0]]['MJD2'] = res[_key][t[0]]['MJD'][:,None] + 0*res['WL'][None,:]
-                        res[_key][t[0]]['u'] = np.append(res[_key][t[0]]['u'],
-                                                       s[0]*res['OI_T3'][k]['u1'][i])
-                        res[_key][t[0]]['v'] = np.append(res[_key][t[0]]['v'],
-                                                       s[0]*res['OI_T3'][k]['v1'][i])
-                        res[_key][t[0]]['u/wl'] = np.append(res[_key][t[0]]['u/wl'],
-                                                       s[0]*np.array([res['OI_T3'][k]['u1'][i]/
-                                                       res['WL']]), axis=0)
-                        res[_key][t[0]]['v/wl'] = np.append(res[_key][t[0]]['v/wl'],
-                                                       s[0]*np.array([res['OI_T3'][k]['v1'][i]/
-                                                       res['WL']]), axis=0)
-                        res[_key][t[0]]['PA'] = np.angle(res[_key][t[0]]['v/wl']+
-                                                     1j*res[_key][t[0]]['u/wl'], deg=True)
-
-                        res[_key][t[0]]['B/wl'] = np.append(res[_key][t[0]]['B/wl'],
-                                                     np.array([np.sqrt(res['OI_T3'][k]['u1'][i]**2+
-                                                                       res['OI_T3'][k]['v1'][i]**2)/
-                                                     res['WL']]), axis=0)
-                        res[_key][t[0]]['FLAG'] = np.append(res[_key][t[0]]['FLAG'],
-                                                    np.array([np.ones(len(res['WL']), dtype=bool)]), axis=0)
-
-                    #if key=='OI_VIS':
-                    res['OI_VIS'][t[0]]['|V|'] = np.append(res['OI_VIS'][t[0]]['|V|'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS'][t[0]]['E|V|'] = np.append(res['OI_VIS'][t[0]]['E|V|'],
-                                             np.array([res['WL']*0+1]), axis=0)
-                    res['OI_VIS'][t[0]]['PHI'] = np.append(res['OI_VIS'][t[0]]['PHI'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS'][t[0]]['EPHI'] = np.append(res['OI_VIS'][t[0]]['EPHI'],
-                                            np.array([res['WL']*0+1]), axis=0)
-                    #else:
-                    res['OI_VIS2'][t[0]]['V2'] = np.append(res['OI_VIS2'][t[0]]['V2'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS2'][t[0]]['EV2'] = np.append(res['OI_VIS2'][t[0]]['EV2'],
-                                            np.array([res['WL']*0+1]), axis=0)
-                    if debug:
-                        print(' test:', mjd, t[0], res['OI_VIS'][t[0]]['MJD'], w0)
-
-                if min(np.abs(res[key][t[1]]['MJD']-mjd))<1e-4:
-                    #w1.append(np.argmin(np.abs(res[key][t[1]]['MJD']-mjd)))
-                    w1.append(np.argmin((res[key][t[1]]['MJD']-mjd)**2+
-                                        (res[key][t[1]]['u']-s[1]*res['OI_T3'][k]['u2'][i])**2+
-                                        (res[key][t[1]]['v']-s[1]*res['OI_T3'][k]['v2'][i])**2))
-                else:
-                    w1.append(len(res[key][t[1]]['MJD']))
-                    if debug:
-                        print('\033[43mWARNING\033[0m: missing MJD [1]', mjd, k, key, t[1])
-                    # -- add fake data for MJD
-                    for _key in ['OI_VIS', 'OI_VIS2']:
-                        res[_key][t[1]]['MJD'] = np.append(res[_key][t[1]]['MJD'], mjd)
-                        res[_key][t[1]]['MJD2'] = res[_key][t[1]]['MJD'][:,None] + 0*res['WL'][None,:]
-
-                        res[_key][t[1]]['u'] = np.append(res[_key][t[1]]['u'],
-                                                       s[1]*res['OI_T3'][k]['u2'][i])
-                        res[_key][t[1]]['v'] = np.append(res[_key][t[1]]['v'],
-                                                       s[1]*res['OI_T3'][k]['v2'][i])
-                        res[_key][t[1]]['u/wl'] = np.append(res[_key][t[1]]['u/wl'],
-                                                       s[1]*np.array([res['OI_T3'][k]['u2'][i]/
-                                                       res['WL']]), axis=0)
-                        res[_key][t[1]]['v/wl'] = np.append(res[_key][t[1]]['v/wl'],
-                                                       s[1]*np.array([res['OI_T3'][k]['v2'][i]/
-                                                       res['WL']]), axis=0)
-                        res[_key][t[1]]['PA'] = np.angle(res[_key][t[1]]['v/wl']+
-                                                     1j*res[_key][t[1]]['u/wl'], deg=True)
-
-                        res[_key][t[1]]['B/wl'] = np.append(res[_key][t[1]]['B/wl'],
-                                                     np.array([np.sqrt(res['OI_T3'][k]['u2'][i]**2+
-                                                                       res['OI_T3'][k]['v2'][i]**2)/
-                                                     res['WL']]), axis=0)
-                        res[_key][t[1]]['FLAG'] = np.append(res[_key][t[1]]['FLAG'],
-                                                    np.array([np.ones(len(res['WL']), dtype=bool)]), axis=0)
-                    #if key=='OI_VIS':
-                    res['OI_VIS'][t[1]]['|V|'] = np.append(res['OI_VIS'][t[1]]['|V|'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS'][t[1]]['E|V|'] = np.append(res['OI_VIS'][t[1]]['E|V|'],
-                                             np.array([res['WL']*0+1]), axis=0)
-                    res['OI_VIS'][t[1]]['PHI'] = np.append(res['OI_VIS'][t[1]]['PHI'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS'][t[1]]['EPHI'] = np.append(res['OI_VIS'][t[1]]['EPHI'],
-                                            np.array([res['WL']*0+1]), axis=0)
-                    #else:
-                    res['OI_VIS2'][t[1]]['V2'] = np.append(res['OI_VIS2'][t[1]]['V2'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS2'][t[1]]['EV2'] = np.append(res['OI_VIS2'][t[1]]['EV2'],
-                                            np.array([res['WL']*0+1]), axis=0)
-                    if debug:
-                        print(' test:', mjd, t[1], res['OI_VIS'][t[1]]['MJD'], w1)
-
-                if min(np.abs(res[key][t[2]]['MJD']-mjd))<1e-4:
-                    #w2.append(np.argmin(np.abs(res[key][t[2]]['MJD']-mjd)))
-                    w2.append(np.argmin((res[key][t[2]]['MJD']-mjd)**2+
-                                        (res[key][t[2]]['u']+s[2]*res['OI_T3'][k]['u1'][i]+s[2]*res['OI_T3'][k]['u2'][i])**2+
-                                        (res[key][t[2]]['v']+s[2]*res['OI_T3'][k]['v1'][i]+s[2]*res['OI_T3'][k]['v2'][i])**2))
-
-                else:
-                    # -- will be added at the end
-                    w2.append(len(res[key][t[2]]['MJD']))
-                    if debug:
-                        print('\033[43mWARNING\033[0m: missing MJD [2]', mjd, k, key, t[2])
-                    # -- add fake data for MJD
-                    for _key in ['OI_VIS', 'OI_VIS2']:
-                        kldg = 1
-                        res[_key][t[2]]['MJD'] = np.append(res[_key][t[2]]['MJD'], mjd)
-                        res[_key][t[2]]['MJD2'] = res[_key][t[2]]['MJD'][:,None] + 0*res['WL'][None,:]
-
-                        res[_key][t[2]]['u'] = np.append(res[_key][t[2]]['u'],
-                                                       -kldg*s[2]*res['OI_T3'][k]['u1'][i]
-                                                       -kldg*s[2]*res['OI_T3'][k]['u2'][i])
-                        res[_key][t[2]]['v'] = np.append(res[_key][t[2]]['v'],
-                                                       -kldg*s[2]*res['OI_T3'][k]['v1'][i]
-                                                       -kldg*s[2]*res['OI_T3'][k]['v2'][i])
-                        res[_key][t[2]]['u/wl'] = np.append(res[_key][t[2]]['u/wl'],
-                                                       kldg*s[2]*np.array([(-res['OI_T3'][k]['u1'][i]
-                                                                       -res['OI_T3'][k]['u2'][i])/
-                                                       res['WL']]), axis=0)
-                        res[_key][t[2]]['v/wl'] = np.append(res[_key][t[2]]['v/wl'],
-                                                       kldg*s[2]*np.array([(-res['OI_T3'][k]['v1'][i]
-                                                                       -res['OI_T3'][k]['v2'][i])/
-                                                       res['WL']]), axis=0)
-                        res[_key][t[2]]['PA'] = np.angle(res[_key][t[2]]['v/wl']+
-                                                     1j*res[_key][t[2]]['u/wl'], deg=True)
-
-                        res[_key][t[2]]['B/wl'] = np.append(res[_key][t[2]]['B/wl'],
-                                                     np.array([np.sqrt((res['OI_T3'][k]['u1'][i]+res['OI_T3'][k]['u2'][i])**2+
-                                                                       (res['OI_T3'][k]['v1'][i]+res['OI_T3'][k]['v2'][i])**2)/
-                                                     res['WL']]), axis=0)
-                        res[_key][t[2]]['FLAG'] = np.append(res[_key][t[2]]['FLAG'],
-                                                    np.array([np.ones(len(res['WL']), dtype=bool)]), axis=0)
-                    res['OI_VIS'][t[2]]['|V|'] = np.append(res['OI_VIS'][t[2]]['|V|'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS'][t[2]]['E|V|'] = np.append(res['OI_VIS'][t[2]]['E|V|'],
-                                            np.array([res['WL']*0+1]), axis=0)
-                    res['OI_VIS'][t[2]]['PHI'] = np.append(res['OI_VIS'][t[2]]['PHI'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS'][t[2]]['EPHI'] = np.append(res['OI_VIS'][t[2]]['EPHI'],
-                                            np.array([res['WL']*0+1]), axis=0)
-                    res['OI_VIS2'][t[2]]['V2'] = np.append(res['OI_VIS2'][t[2]]['V2'],
-                                            np.array([res['WL']*0]), axis=0)
-                    res['OI_VIS2'][t[2]]['EV2'] = np.append(res['OI_VIS2'][t[2]]['EV2'],
-                                            np.array([res['WL']*0+1]), axis=0)
-                    if debug:
-                        print(' test:', mjd, t[2], res['OI_VIS'][t[2]]['MJD'], w2)
-
-            res['OI_T3'][k]['formula'] = [s, t, w0, w1, w2]
+            # -- u, v of the 3 baselines of the triangle, for each T3 row
+            mjds, u1, v1, u2, v2 = T3['MJD'], T3['u1'], T3['v1'], T3['u2'], T3['v2']
+            U = [s[0]*u1, s[1]*u2, -s[2]*u1-s[2]*u2]
+            V = [s[0]*v1, s[1]*v2, -s[2]*v1-s[2]*v2]
+            # -- to be added to the baselines' u, v to compare with the T3's
+            dU = [[-s[0]*u1], [-s[1]*u2], [s[2]*u1, s[2]*u2]]
+            dV = [[-s[0]*v1], [-s[1]*v2], [s[2]*v1, s[2]*v2]]
+            W = []
+            for j in range(3):
+                _mjd, _u, _v = res[key][t[j]]['MJD'], res[key][t[j]]['u'], res[key][t[j]]['v']
+                # -- T3 rows for which fake data are added to the baseline: they
+                # -- are collected and added at once, after the loop
+                new = []
+                w, dmjd = _matchMJDuv(_mjd, _u, _v, mjds, dU[j], dV[j])
+                w = w.tolist()
+                # check data are within ~10s: once a fake row is needed, the
+                # following T3 rows are also matched against the fake rows
+                miss = np.flatnonzero(dmjd>=1e-4)
+                for i in range(miss[0] if len(miss) else len(mjds), len(mjds)):
+                    mjd = mjds[i]
+                    if len(new):
+                        _w, _d = _matchMJDuv(np.append(_mjd, mjds[new]), np.append(_u, U[j][new]),
+                                             np.append(_v, V[j][new]), mjds[i:i+1],
+                                             [x[i:i+1] for x in dU[j]],
+                                             [x[i:i+1] for x in dV[j]])
+                    else:
+                        _w, _d = w[i:i+1], dmjd[i:i+1]
+                    if _d[0]<1e-4:
+                        w[i] = int(_w[0])
+                    else:
+                        # -- will be added at the end
+                        w[i] = len(_mjd)+len(new)
+                        new.append(i)
+                        if debug:
+                            print('\033[43mWARNING\033[0m: missing MJD [%d]'%j, mjd, k, key, t[j])
+                W.append(w)
+                if not len(new):
+                    continue
+                # -- add fake data for missing MJDs
+                new = np.array(new)
+                uwl = U[j][new].astype(dtype)[:,None]*invWL[None,:]
+                vwl = V[j][new].astype(dtype)[:,None]*invWL[None,:]
+                bwl = np.hypot(uwl, vwl)
+                # -- PA only for the new rows
+                pa = np.arctan2(uwl, vwl)
+                pa *= 180/np.pi
+                for _key in ['OI_VIS', 'OI_VIS2']:
+                    tmp = res[_key][t[j]]
+                    tmp['MJD'] = _extendRows(tmp['MJD'], len(new), mjds[new])
+                    tmp['MJD2'] = _extendRows(tmp['MJD2'], len(new), mjds[new][:,None])
+                    tmp['u'] = _extendRows(tmp['u'], len(new), U[j][new])
+                    tmp['v'] = _extendRows(tmp['v'], len(new), V[j][new])
+                    tmp['u/wl'] = _extendRows(tmp['u/wl'], len(new), uwl)
+                    tmp['v/wl'] = _extendRows(tmp['v/wl'], len(new), vwl)
+                    tmp['B/wl'] = _extendRows(tmp['B/wl'], len(new), bwl)
+                    tmp['PA'] = _extendRows(tmp['PA'], len(new), pa)
+                    tmp['FLAG'] = _extendRows(tmp['FLAG'], len(new), True)
+                for _key, _k in [('OI_VIS', '|V|'), ('OI_VIS', 'PHI'), ('OI_VIS2', 'V2')]:
+                    tmp = res[_key][t[j]]
+                    tmp[_k] = _extendRows(tmp[_k], len(new), 0.0)
+                    tmp['E'+_k] = _extendRows(tmp['E'+_k], len(new), 1.0)
+                if debug:
+                    print(' test:', t[j], res['OI_VIS'][t[j]]['MJD'], w)
+            w0, w1, w2 = W
+            T3['formula'] = [s, t, w0, w1, w2]
             # except:
             #     print('warning! triplet', k,
             #           'has no formula in', res[key].keys())
@@ -991,17 +847,21 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
     if 'OI_FLUX' in res:
         res['telescopes'] = sorted(list(res['OI_FLUX'].keys()))
     else:
-        res['telescopes'] = []
+        tels = set()
         for k in res[key].keys():
-            res['telescopes'].append(k[:len(k)//2])
-            res['telescopes'].append(k[len(k)//2:])
-        res['telescopes'] = sorted(list(set(res['telescopes'])))
+            tels.add(k[:len(k)//2])
+            tels.add(k[len(k)//2:])
+        res['telescopes'] = sorted(tels)
     res['baselines'] = sorted(list(res[key].keys()))
     if 'OI_T3' in res.keys():
         res['triangles'] = sorted(list(res['OI_T3'].keys()))
     else:
         res['triangles'] = []
 
+    if not _TPH is None:
+        # -- after TELLURICS, which can replace WL by CORR_WAVE
+        res['n_lab'] = _n_JHK_cached(res['WL'].astype(np.float64).tobytes(), *_TPH).copy()
+
     if not 'TELLURICS' in res.keys():
         res['TELLURICS'] = np.ones(res['WL'].shape)
 
@@ -1025,18 +885,15 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
             kernel_size = None
         res = medianFilt(res, kernel_size)
 
+    # -- dicts with None values are used as ordered sets
     confperMJD = {}
     for l in filter(lambda x: x in ['OI_VIS', 'OI_VIS2', 'OI_T3', 'OI_FLUX'], res.keys()):
         for k in res[l].keys():
-            for mjd in res[l][k]['MJD']:
-                if not mjd in confperMJD.keys():
-                    confperMJD[mjd] = [k]
-                else:
-                    if not k in confperMJD[mjd]:
-                        confperMJD[mjd].append(k)
-    res['configurations per MJD'] = confperMJD
+            for mjd in dict.fromkeys(res[l][k]['MJD']):
+                confperMJD.setdefault(mjd, {})[k] = None
+    res['configurations per MJD'] = {mjd:list(c) for mjd,c in confperMJD.items()}
     # -- all MJDs in the file
-    res['MJD'] = np.array(sorted(set(res['configurations per MJD'].keys())))
+    res['MJD'] = np.unique(np.fromiter(res['configurations per MJD'], dtype=float))
 
     # -- mean barycentric correction for the dataset
     if 'ORIGIN' in h[0].header and h[0].header['ORIGIN']=='ESO-PARANAL':
@@ -1053,8 +910,8 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
         for e in ['OI_VIS2', 'OI_VIS', 'OI_T3', 'OI_FLUX']:
             if e in res.keys():
                 for k in res[e].keys():
-                    mjd.extend(list(res[e][k]['MJD']))
-        mjd = np.array(sorted(set(mjd)))
+                    mjd.append(res[e][k]['MJD'])
+        mjd = np.unique(np.concatenate(mjd))
         #print('  > MJD:', sorted(set(mjd)))
         print('  > MJD:', mjd.shape, '[', min(mjd), '..', max(mjd), ']')
         print('  >', '-'.join(res['telescopes']), end=' | ')
@@ -1066,9 +923,8 @@ def loadOI(filename, insname=None, targname=None, verbose=True,
             print('(binx%d)'%binning, end=' ')
         #print(sorted(list(filter(lambda x: x.startswith('OI_'), res.keys()))),
         #            end=' | ')
-        Kz = sorted(list(filter(lambda x: x.startswith('OI_'), res.keys())))
-        _Kz = [_k.split('OI_')[1] for _k in Kz]
-        print(dict(zip(_Kz, [len(res[k].keys()) for k in Kz])), end=' | ')
+        Kz = sorted(k for k in res if k.startswith('OI_'))
+        print({k.split('OI_')[1]:len(res[k]) for k in Kz}, end=' | ')
 
         print('TELL:', res['TELLURICS'].min()<1
                         if not ignoredTellurics else 'IGNORED!', end=' ')
@@ -1102,7 +958,7 @@ def match_VIS_VIS2_CF(res, debug=False, ignoreCF=False):
                     if not 'CF' in x and not 'PHI' in x:
                         res['OI_VIS'][k][x] = res['OI_VIS2'][k][x].copy()
                 # -- all data are invalid
-                res['OI_VIS'][k]['FLAG'] = np.logical_or(res['OI_CF'][k]['FLAG'], True)
+                res['OI_VIS'][k]['FLAG'] = np.ones(res['OI_CF'][k]['FLAG'].shape, dtype=bool)
                 res['OI_VIS'][k]['|V|'] = 0*res['OI_CF'][k]['CF']
                 res['OI_VIS'][k]['E|V|'] = 1 + 0*res['OI_CF'][k]['ECF']
                 res['OI_VIS'][k]['PHI'] = 0*res['OI_CF'][k]['CF']
@@ -1116,23 +972,23 @@ def match_VIS_VIS2_CF(res, debug=False, ignoreCF=False):
                     if not '|V|' in x and not 'PHI' in x:
                         res['OI_CF'][k][x] = res['OI_VIS'][k][x].copy()
                 # -- all data are invalid
-                res['OI_CF'][k]['FLAG'] = np.logical_or(res['OI_VIS'][k]['FLAG'], True)
+                res['OI_CF'][k]['FLAG'] = np.ones(res['OI_VIS'][k]['FLAG'].shape, dtype=bool)
                 res['OI_CF'][k]['CF'] = 0*res['OI_VIS'][k]['|V|']
                 res['OI_CF'][k]['ECF'] = 1+0*res['OI_VIS'][k]['E|V|']
                 res['OI_CF'][k]['PHI'] = 0*res['OI_VIS'][k]['|V|']
                 res['OI_CF'][k]['EPHI'] = 360+0*res['OI_VIS'][k]['E|V|']
 
-            if sorted(res['OI_VIS'][k]['MJD']) != sorted(res['OI_CF'][k]['MJD']):
+            if not np.array_equal(np.sort(res['OI_VIS'][k]['MJD']), np.sort(res['OI_CF'][k]['MJD'])):
                 if debug:
                     print(k, '\033[43mmismatched coverage VIS/CF!\033[0m')
                     print(' VIS:',  res['OI_VIS'][k]['MJD'])
                     print(' CF :',  res['OI_CF'][k]['MJD'])
                 # -- all encountered MJDs:
-                allMJD = sorted(list(res['OI_VIS'][k]['MJD'])+list(res['OI_CF'][k]['MJD']))
-                # -- ones from VIS
-                wv = [allMJD.index(mjd) for mjd in res['OI_VIS'][k]['MJD']]
+                allMJD = np.sort(np.concatenate([res['OI_VIS'][k]['MJD'], res['OI_CF'][k]['MJD']]))
+                # -- ones from VIS (first occurence in allMJD)
+                wv = np.searchsorted(allMJD, res['OI_VIS'][k]['MJD'])
                 # -- ones from VIS2
-                wv2 = [allMJD.index(mjd) for mjd in res['OI_CF'][k]['MJD']]
+                wv2 = np.searchsorted(allMJD, res['OI_CF'][k]['MJD'])
 
                 #print(' ', wv, wv2)
                 # -- update VIS
@@ -1188,7 +1044,7 @@ def match_VIS_VIS2_CF(res, debug=False, ignoreCF=False):
                     if not 'V2' in x:
                         res['OI_VIS'][k][x] = res['OI_VIS2'][k][x].copy()
                 # -- all data are invalid
-                res['OI_VIS'][k]['FLAG'] = np.logical_or(res['OI_VIS2'][k]['FLAG'], True)
+                res['OI_VIS'][k]['FLAG'] = np.ones(res['OI_VIS2'][k]['FLAG'].shape, dtype=bool)
                 res['OI_VIS'][k]['|V|'] = 0*res['OI_VIS2'][k]['V2']
                 res['OI_VIS'][k]['E|V|'] = 1 + 0*res['OI_VIS2'][k]['EV2']
                 res['OI_VIS'][k]['PHI'] = 0*res['OI_VIS2'][k]['V2']
@@ -1202,21 +1058,21 @@ def match_VIS_VIS2_CF(res, debug=False, ignoreCF=False):
                     if not '|V|' in x and not 'PHI' in x:
                         res['OI_VIS2'][k][x] = res['OI_VIS'][k][x].copy()
                 # -- all data are invalid
-                res['OI_VIS2'][k]['FLAG'] = np.logical_or(res['OI_VIS2'][k]['FLAG'], True)
+                res['OI_VIS2'][k]['FLAG'] = np.ones(res['OI_VIS2'][k]['FLAG'].shape, dtype=bool)
                 res['OI_VIS2'][k]['V2'] = 0*res['OI_VIS'][k]['|V|']
                 res['OI_VIS2'][k]['EV2'] = 1+0*res['OI_VIS'][k]['E|V|']
 
-            if sorted(res['OI_VIS'][k]['MJD']) != sorted(res['OI_VIS2'][k]['MJD']):
+            if not np.array_equal(np.sort(res['OI_VIS'][k]['MJD']), np.sort(res['OI_VIS2'][k]['MJD'])):
                 if debug:
                     print(k, '\033[43mmismatched coverage VIS/VIS2!\033[0m')
                     print(' VIS :',  res['OI_VIS'][k]['MJD'])
                     print(' VIS2:',  res['OI_VIS2'][k]['MJD'])
                 # -- all encountered MJDs:
-                allMJD = sorted(list(res['OI_VIS'][k]['MJD'])+list(res['OI_VIS2'][k]['MJD']))
-                # -- ones from VIS
-                wv = [allMJD.index(mjd) for mjd in res['OI_VIS'][k]['MJD']]
+                allMJD = np.sort(np.concatenate([res['OI_VIS'][k]['MJD'], res['OI_VIS2'][k]['MJD']]))
+                # -- ones from VIS (first occurence in allMJD)
+                wv = np.searchsorted(allMJD, res['OI_VIS'][k]['MJD'])
                 # -- ones from VIS2
-                wv2 = [allMJD.index(mjd) for mjd in res['OI_VIS2'][k]['MJD']]
+                wv2 = np.searchsorted(allMJD, res['OI_VIS2'][k]['MJD'])
                 if debug:
                     print('DEBUD: wv2=', wv2)
                 #print(' ', wv, wv2)
@@ -1268,10 +1124,90 @@ def match_VIS_VIS2_CF(res, debug=False, ignoreCF=False):
 
 def wTarg(hdu, targname, targets):
     if type(targets[targname]) == list:
-        return np.array([x in targets[targname] for x in hdu.data['TARGET_ID']])
+        return np.isin(hdu.data['TARGET_ID'], targets[targname])
     else:
         return hdu.data['TARGET_ID']==targets[targname]
 
+def _matchMJDuv(MJD, u, v, mjd, dU, dV):
+    """
+    for each mjd, index of the closest (MJD, u, v) in the sense of
+    (MJD-mjd)**2+(u+dU)**2+(v+dV)**2: dU, dV are lists of arrays (like mjd)
+    summed to u, v in that order. Also returns the distance of each mjd to the
+    closest MJD. MJD must not be empty.
+    """
+    MJD, mjd = np.asarray(MJD), np.asarray(mjd)
+    # -- distance to the closest MJD, using sorted MJDs
+    o = np.argsort(MJD)
+    pos = np.searchsorted(MJD[o], mjd)
+    i0 = o[np.clip(pos-1, 0, len(MJD)-1)]
+    i1 = o[np.clip(pos, 0, len(MJD)-1)]
+    dmjd = np.minimum(np.abs(MJD[i0]-mjd), np.abs(MJD[i1]-mjd))
+    # -- closest in (MJD, u, v), by blocks to limit memory
+    idx = np.zeros(len(mjd), dtype=int)
+    n = max(1, 2**20//max(len(MJD), 1))
+    for i in range(0, len(mjd), n):
+        _u, _v = u[None,:], v[None,:]
+        for x in dU:
+            _u = _u + x[i:i+n,None]
+        for x in dV:
+            _v = _v + x[i:i+n,None]
+        d2 = (MJD[None,:]-mjd[i:i+n,None])**2 + _u**2 + _v**2
+        idx[i:i+n] = np.argmin(d2, axis=1)
+    return idx, dmjd
+
+def _groupRows(names, wt=None):
+    """
+    list of (name, indices of the rows) for each unique name (sorted). If the
+    mask wt is given, only the rows where wt is True are kept (names with no
+    row left are still listed, with an empty array of indices).
+    """
+    uniq, inv = np.unique(names, return_inverse=True)
+    order = np.argsort(inv, kind='stable')
+    splits = np.searchsorted(inv[order], np.arange(len(uniq)+1))
+    res = []
+    for i, k in enumerate(uniq.tolist()):
+        idx = order[splits[i]:splits[i+1]]
+        if not wt is None:
+            idx = idx[wt[idx]]
+        res.append((k, idx))
+    return res
+
+def _extendRows(x, n, y):
+    """
+    x with n rows added at the end, allocated once at the final size. The new
+    rows are set to y (scalar or array broadcastable to the new rows).
+    """
+    res = np.empty((len(x)+n,)+x.shape[1:], dtype=np.result_type(x, y))
+    res[:len(x)] = x
+    res[len(x):] = y
+    return res
+
+def _staNames(oiarray, staIndex):
+    """
+    names of telescopes (STA_INDEX is 1D) or baselines / triangles (STA_INDEX
+    is 2D) from the OI_ARRAY dict {index:name}. If oiarray is None, names are
+    "STA"+index. Raises KeyError if an index is not in oiarray.
+    """
+    staIndex = np.asarray(staIndex)
+    if oiarray is None:
+        tel = np.char.add('STA', staIndex.astype(str))
+    else:
+        # -- gather in a table indexed by station index
+        table = np.zeros(max(oiarray)+1, dtype=object)
+        known = np.zeros(max(oiarray)+1, dtype=bool)
+        for i in oiarray:
+            table[i], known[i] = str(oiarray[i]), True
+        if staIndex.size and (staIndex.min()<0 or staIndex.max()>=len(table) or
+                              not all(known[staIndex.flatten()])):
+            raise KeyError('station index not in OI_ARRAY')
+        tel = table[staIndex].astype(str)
+    if tel.ndim==1:
+        return tel
+    res = tel[:,0]
+    for j in range(1, tel.shape[1]):
+        res = np.char.add(res, tel[:,j])
+    return res
+
 def binOI(_wl, WL, T, F, E=None, medFilt=None, retFlag=False, phase=False):
     """
     _wl: new WL vector
@@ -1281,23 +1217,31 @@ def binOI(_wl, WL, T, F, E=None, medFilt=None, retFlag=False, phase=False):
     """
     res = np.zeros((T.shape[0], len(_wl)))
     flag = np.zeros((T.shape[0], len(_wl)), dtype=bool)
-    for i in range(T.shape[0]):
-        w = ~F[i,:]
-        # -- half of the points in the bin are valid
-        #flag[i,:] = np.bool_(_binVec(_wl, WL, np.float_(F[i,:]))>0.5)
-
-        # -- 2/3 of the points in the bin are valid
-        #flag[i,:] = np.bool_(_binVec(_wl, WL, np.float_(F[i,:]))>2/3)
-        
-        # -- at least one point in the bin is valid
-        flag[i,:] = ~np.bool_(_binVec(_wl, WL, np.float_(~F[i,:]), phase=phase)>0)
-        if E is None:
-            res[i,:] = _binVec(_wl, WL[w], T[i,:][w], medFilt=medFilt, phase=phase)
-        else:
-            try:
-                res[i,:] = _binVec(_wl, WL[w], T[i,:][w], E=E[i,:][w], medFilt=medFilt, phase=phase)
-            except:
-                res[i,:] = np.nan
+    Gx = np.gradient(_wl)
+    one = np.ones(len(WL))
+    # -- kernels are the same for all rows: only the valid columns change.
+    # -- built by blocks of new WL to limit memory, as in _binVec
+    n = max(1, 2**20//max(len(WL), 1))
+    for j in range(0, len(_wl), n):
+        sl = slice(j, j+n)
+        K = _binKernels(_wl[sl], WL, Gx[sl])
+        for i in range(T.shape[0]):
+            w = ~F[i,:]
+            # -- half of the points in the bin are valid
+            #flag[i,:] = np.bool_(_binVec(_wl, WL, np.float64(F[i,:]))>0.5)
+
+            # -- 2/3 of the points in the bin are valid
+            #flag[i,:] = np.bool_(_binVec(_wl, WL, np.float64(F[i,:]))>2/3)
+
+            # -- at least one point in the bin is valid
+            flag[i,sl] = ~np.bool_(_binKernelSum(K, np.float64(w), one, phase=phase)>0)
+            if E is None:
+                res[i,sl] = _binKernelSum(K[:,w], T[i,:][w], one[w], phase=phase)
+            else:
+                try:
+                    res[i,sl] = _binKernelSum(K[:,w], T[i,:][w], 1/E[i,:][w], phase=phase)
+                except:
+                    res[i,sl] = np.nan
     if retFlag:
         return res, flag
     return res
@@ -1314,22 +1258,39 @@ def _binVec(x, X, Y, E=None, medFilt=None, phase=False):
     y = np.zeros(len(x))
     Gx = np.gradient(x)
     #dx = np.median(np.diff(x))
-    for i,x0 in enumerate(x):
-        # -- kernel
-        #k = np.exp(-(X-x0)**2/(0.6*dx)**2)
-        k = np.exp(-(X-x0)**2/(0.6*Gx[i])**2)
-        no = np.sum(k/E) # normalisation
-        if no!=0 and np.isfinite(no):
-            y[i] = np.sum(k/E*Y)/no
-        else:
-            y[i] = np.sum(k*Y)/np.sum(k)
+    invE = 1/E
+    # -- all kernels at once, by blocks of new x to limit memory
+    n = max(1, 2**20//max(len(X), 1))
+    for i in range(0, len(x), n):
+        sl = slice(i, i+n)
+        y[sl] = _binKernelSum(_binKernels(x[sl], X, Gx[sl]), Y, invE, phase=phase)
+    return y
+
+def _binKernels(x, X, Gx):
+    """
+    gaussian kernels of _binVec, one row per x. Gx is the local step of x
+    """
+    #k = np.exp(-(X-x0)**2/(0.6*dx)**2)
+    return np.exp(-(X[None,:]-x[:,None])**2/(0.6*Gx[:,None])**2)
+
+def _binKernelSum(k, Y, invE, phase=False):
+    """
+    binned values of Y for kernels k (one row per bin), weighted by invE
+    """
+    no = k@invE # normalisation
+    ok = (no!=0)*np.isfinite(no)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y = np.where(ok, (k@(invE*Y))/no, (k@Y)/np.sum(k, axis=1))
         if phase:
-            if no!=0 and np.isfinite(no):
-                y[i] = np.sum(k/E*((Y-y[i]+180)%360 - 180 + y[i]))/no
-            else:
-                y[i] = np.sum(k*((Y-y[i]+180)%360 - 180 + y[i]))/np.sum(k)
+            _Y = (Y[None,:]-y[:,None]+180)%360 - 180 + y[:,None]
+            y = np.where(ok, np.sum(k*invE*_Y, axis=1)/no,
+                         np.sum(k*_Y, axis=1)/np.sum(k, axis=1))
     return y
 
+# -- 'fit' entries kept by mergeOI: the error-based ones are applied to the data
+_mergeOI_fitKeep = {'obs', 'wl ranges', 'baseline ranges', 'continuum ranges',
+                    'prior', 'Nr', 'DPHI order', 'D|V| order', 'NFLUX order'}
+
 def mergeOI(OI, collapse=True, groups=None, verbose=False, debug=False):
     """
     takes OI, a list of oifits files readouts (from loadOI), and merge them into
@@ -1347,6 +1308,8 @@ def mergeOI(OI, collapse=True, groups=None, verbose=False, debug=False):
     merged = [] # list of unique setup which have been merged so far
     master = [] # same length as OI, True if element hold merged data for the setup
     res = [] # result
+    # -- arrays to be concatenated once all data are read: {(i0, l, k, t):[arrays]}
+    toMerge = {}
 
     # -- for each data dict
     for i, oi in enumerate(OI):
@@ -1453,14 +1416,12 @@ def mergeOI(OI, collapse=True, groups=None, verbose=False, debug=False):
                     if debug:
                         print(l, k, res[i0][l][k].keys())
                     for t in ext1:
-                        # -- append len(MJDs) data
-                            res[i0][l][k][t] = np.append(res[i0][l][k][t], oi[l][k][t])
+                        # -- append len(MJDs) data (flattened, as np.append)
+                        toMerge.setdefault((i0, l, k, t), [np.ravel(res[i0][l][k][t])]).append(
+                                            np.ravel(oi[l][k][t]))
                     for t in ext2:
                         # -- append (len(MJDs),len(WL)) data
-                        try:
-                            s1 = res[i0][l][k][t].shape # = (len(MJDs),len(WL))
-                            s2 = oi[l][k][t].shape # = (len(MJDs),len(WL))
-                        except:
+                        if not (t in res[i0][l][k] and t in oi[l][k]):
                             print('ERROR!', l, k)
                         if t.startswith('E') and t[1:] in oi[l][k] and 'fit' in oi:
                             # -- errors -> allow editing
@@ -1471,8 +1432,11 @@ def mergeOI(OI, collapse=True, groups=None, verbose=False, debug=False):
                             tmp = _filtFlag(oi[l][k], oi['fit'])
                         else:
                             tmp = oi[l][k][t]
-                        res[i0][l][k][t] = np.append(res[i0][l][k][t], tmp)
-                        res[i0][l][k][t] = res[i0][l][k][t].reshape(s1[0]+s2[0], s1[1])
+                        toMerge.setdefault((i0, l, k, t), [res[i0][l][k][t]]).append(tmp)
+
+    # -- one concatenation per merged quantity
+    for (i0, l, k, t), x in toMerge.items():
+        res[i0][l][k][t] = np.concatenate(x)
 
     for r in res:
         for k in ['telescopes', 'baselines', 'triangles']:
@@ -1580,18 +1544,13 @@ def mergeOI(OI, collapse=True, groups=None, verbose=False, debug=False):
                     key = None
                 try:
                     #print(k, r[key].keys())
-                    for i,mjd in enumerate(r['OI_T3'][k]['MJD']):
-                        _w0.append(np.argmin((r[key][t[0]]['MJD']-mjd)**2+
-                                            (r[key][t[0]]['u']-s[0]*r['OI_T3'][k]['u1'][i])**2+
-                                            (r[key][t[0]]['v']-s[0]*r['OI_T3'][k]['v1'][i])**2))
-                        _w1.append(np.argmin((r[key][t[1]]['MJD']-mjd)**2+
-                                            (r[key][t[1]]['u']-s[1]*r['OI_T3'][k]['u2'][i])**2+
-                                            (r[key][t[1]]['v']-s[1]*r['OI_T3'][k]['v2'][i])**2))
-                        _w2.append(np.argmin((r[key][t[2]]['MJD']-mjd)**2+
-                                            (r[key][t[2]]['u']+s[2]*r['OI_T3'][k]['u1'][i]+
-                                                    s[2]*r['OI_T3'][k]['u2'][i])**2+
-                                            (r[key][t[2]]['v']+s[2]*r['OI_T3'][k]['v1'][i]+
-                                                    s[2]*r['OI_T3'][k]['v2'][i])**2))
+                    T3 = r['OI_T3'][k]
+                    mjds, u1, v1, u2, v2 = T3['MJD'], T3['u1'], T3['v1'], T3['u2'], T3['v2']
+                    for _w, _t, dU, dV in [(_w0, t[0], [-s[0]*u1], [-s[0]*v1]),
+                                           (_w1, t[1], [-s[1]*u2], [-s[1]*v2]),
+                                           (_w2, t[2], [s[2]*u1, s[2]*u2], [s[2]*v1, s[2]*v2])]:
+                        B = r[key][_t]
+                        _w.extend(_matchMJDuv(B['MJD'], B['u'], B['v'], mjds, dU, dV)[0].tolist())
                     r['OI_T3'][k]['formula'] = [s, t, _w0, _w1, _w2]
                 except:
                     tmp = sorted(list(r[key].keys()))
@@ -1633,15 +1592,12 @@ def mergeOI(OI, collapse=True, groups=None, verbose=False, debug=False):
                             tmp[k][p] = r['fit'][k][p]
                         else:
                             tmp[k] = {p:r['fit'][k][p]}
-            r['fit'] = {k:r['fit'][k] for k in ['obs', 'wl ranges', 'baseline ranges',
-                                                'continuum ranges', 'prior', 'Nr',
-                                                'DPHI order', 'D|V| order',
-                                                'NFLUX order']
-                        if k in r['fit']}
+            for k in [k for k in r['fit'] if not k in _mergeOI_fitKeep]:
+                r['fit'].pop(k)
             r['fit'].update(tmp)
 
     for r in res:
-        r['MJD'] = np.array(sorted(set(r['configurations per MJD'].keys())))
+        r['MJD'] = np.unique(np.fromiter(r['configurations per MJD'], dtype=float))
 
     return res
 
@@ -1651,7 +1607,7 @@ def _filtErr(t, ext, filt, debug=False):
     ext: dictionnary containing the data (OI extension)
     filt: what to apply to data ('fit' dict from OIDATA)
     """
-    # -- original errors:
+    # -- original errors (copied once, then modified in place):
     err = ext['E'+t].copy()
 
     # == this is now in oimodels.computeNormFluxOI
@@ -1672,44 +1628,55 @@ def _filtErr(t, ext, filt, debug=False):
         if debug:
             print('min error:', t, end=' ')
             print(np.sum(err<filt['min error'][t]), '/', err.size)
-        err = np.maximum(filt['min error'][t], err)
+        np.maximum(filt['min error'][t], err, out=err)
 
     if 'min relative error' in filt.keys() and t in filt['min relative error'].keys():
         if debug:
             print('min relative error:', t, end=' ')
             print(np.sum(err<filt['min relative error'][t]*np.abs(ext[t])),
                     '/', err.size)
-        err = np.maximum(filt['min relative error'][t]*np.abs(ext[t]), err)
+        rel = np.abs(ext[t])
+        rel *= filt['min relative error'][t]
+        np.maximum(rel, err, out=err)
     return err
 
 def _filtFlag(ext, filt, debug=False):
     """
     ext: dictionnary containing data (OI extension)
     """
-    flag = ext['FLAG'].copy()
     if not 'max error' in filt and not 'max relative error' in filt:
-        return flag
+        # -- nothing to do: callers only re-assign the result, no need to copy
+        return ext['FLAG']
+    # -- copied lazily, only once a filter actually flags something
+    flag = None
 
     # -- this is a bit of a Kludge :S
     if 'FLUX' in ext and 'max error' in filt.keys() and 'NFLUX' in filt['max error']:
         filt['max error']['FLUX'] = filt['max error']['NFLUX']*ext['FLUX'].mean()
 
     if 'max error' in filt:
-        for k in filt['max error']:
-            if k == 'DPHI':
-                k = 'PHI'
-            if k == 'D|V|':
-                k = '|V|'
-            if k in filt['max error'] and 'E'+k in ext:
+        for k, maxe in filt['max error'].items():
+            # -- 'DPHI' / 'D|V|' would only repeat the 'PHI' / '|V|' filters
+            if k in ['DPHI', 'D|V|']:
+                continue
+            if 'E'+k in ext:
                 if debug:
                     print('flag: max', k, filt['max error'])
-                flag += ext['E'+k]>=filt['max error'][k]
+                if flag is None:
+                    flag = ext['FLAG'].copy()
+                flag |= ext['E'+k]>=maxe
     if 'max relative error' in filt:
-        for k in filt['max relative error']:
-            if k in filt['max relative error'] and 'E'+k in ext:
+        for k, maxe in filt['max relative error'].items():
+            if 'E'+k in ext:
                 if debug:
                     print('flag: max relative', k)
-                flag += ext['E'+k]>=filt['max relative error'][k]*np.abs(ext[k])
+                rel = np.abs(ext[k])
+                rel *= maxe
+                if flag is None:
+                    flag = ext['FLAG'].copy()
+                flag |= ext['E'+k]>=rel
+    if flag is None:
+        return ext['FLAG']
     return flag
 
 def _allInOneOI(oi, verbose=False, debug=False):
@@ -1718,99 +1685,115 @@ def _allInOneOI(oi, verbose=False, debug=False):
     - averages fluxes per MJD
     - puts all baselines / triangles in same dict
 
+    each observable becomes a single 2D array (all rows of all baselines
+    stacked), oi[ext]['all']['NAME'] gives the baseline / triangle of each
+    row. This is the layout used by the model computations.
     """
     if type(oi)==list:
         return [_allInOneOI(o, verbose=verbose, debug=debug) for o in oi]
 
     for e in filter(lambda x: x in oi, ['OI_FLUX', 'NFLUX']):
-        fluxes = {}
-        weights = {}
         key = {'OI_FLUX':'FLUX', 'NFLUX':'NFLUX'}[e]
-        names = {}
-        for k in oi[e].keys():
-            for j,mjd in enumerate(oi[e][k]['MJD']):
-                mask = ~oi[e][k]['FLAG'][j,:]
-                if not mjd in fluxes:
-                    fluxes[mjd] = np.zeros(len(oi['WL']))
-                    weights[mjd] = np.zeros(len(oi['WL']))
-                    names[mjd] = []
-                fluxes[mjd][mask] += oi[e][k][key][j,mask]/\
-                        oi[e][k]['E'+key][j,mask]
-                weights[mjd][mask] += 1/oi[e][k]['E'+key][j,mask]
-                names[mjd].append(k)
-        flags = {}
-        efluxes = {}
-        for mjd in fluxes.keys():
-            names[mjd] = ';'.join(names[mjd])
-            mask = weights[mjd]>0
-            fluxes[mjd][mask] /= weights[mjd][mask]
-            flags[mjd] = ~mask
-            efluxes[mjd] = np.zeros(len(oi['WL']))
-            efluxes[mjd][mask] = 1/weights[mjd][mask]
+        # -- all rows of all telescopes
+        K = list(oi[e].keys())
+        F, E, mask, MJD = [np.concatenate([oi[e][k][x] for k in K])
+                           for x in [key, 'E'+key, 'FLAG', 'MJD']]
+        mask = ~mask
+        names = sum([[k]*len(oi[e][k]['MJD']) for k in K], [])
+        # -- unique MJDs, in order of first appearance
+        _, first, inv = np.unique(MJD, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty(len(order), dtype=int)
+        rank[order] = np.arange(len(order))
+        inv = rank[np.ravel(inv)]
+        # -- weighted sums per MJD, rows added in the same order as before
+        fluxes = np.zeros((len(order), len(oi['WL'])))
+        weights = np.zeros((len(order), len(oi['WL'])))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            invE = np.where(mask, 1/E, 0.0)
+            np.add.at(fluxes, inv, np.where(mask, F*invE, 0.0))
+            np.add.at(weights, inv, invE)
+        mask = weights>0
+        fluxes[mask] /= weights[mask]
+        efluxes = np.zeros((len(order), len(oi['WL'])))
+        efluxes[mask] = 1/weights[mask]
+        _names = [[] for i in order]
+        for i, k in zip(inv, names):
+            _names[i].append(k)
         oi[e]['all'] = {
-            key: np.array([fluxes[mjd] for mjd in fluxes.keys()]),
-            'E'+key: np.array([efluxes[mjd] for mjd in fluxes.keys()]),
-            'FLAG': np.array([flags[mjd] for mjd in fluxes.keys()]),
-            'NAME': np.array([names[mjd] for mjd in fluxes.keys()]),
-            'MJD': np.array(list(fluxes.keys())),
+            key: fluxes,
+            'E'+key: efluxes,
+            'FLAG': ~mask,
+            'NAME': np.array([';'.join(n) for n in _names]),
+            'MJD': MJD[first[order]],
             }
         oi[e]['all']['MJD2'] = oi[e]['all']['MJD'][:,None]+\
                             0*oi['WL'][None,:]
 
+    t3formula = None
     for e in filter(lambda x: x in oi.keys(), ['OI_VIS', 'OI_VIS2', 'OI_T3', 'OI_CF']):
         tmp = {'NAME':[]}
+        # -- arrays are concatenated once at the end: {d:[arrays]}. "flat" are
+        # -- the data types which got flattened (np.append of 1D data)
+        parts, flat = {}, set()
+        # -- list data (e.g. T3 formula) are kept once per Tel/B/Tri: {d:[(tuple, nrows)]}
+        lists = {}
         for k in filter(lambda x: x!='all', sorted(oi[e].keys())): # each Tel/B/Tri
             tmp['NAME'].extend([k for i in range(len(oi[e][k]['MJD']))])
             for d in oi[e][k].keys(): # each data type
                 if not d in tmp:
+                    tmp[d] = None # -- set after the loop
                     if type(oi[e][k][d])==list:
-                        tmp[d] = [tuple(oi[e][k][d])]*len(oi[e][k]['MJD'])
+                        lists[d] = [(tuple(oi[e][k][d]), len(oi[e][k]['MJD']))]
                     else:
-                        tmp[d] = oi[e][k][d]
+                        parts[d] = [oi[e][k][d]]
                 else:
                     if type(oi[e][k][d])==list:
-                        tmp[d].extend([tuple(oi[e][k][d])]*len(oi[e][k]['MJD']))
+                        lists[d].append((tuple(oi[e][k][d]), len(oi[e][k]['MJD'])))
                     elif type(oi[e][k][d])==np.ndarray:
                         if oi[e][k][d].ndim==1:
-                            tmp[d] = np.append(tmp[d], oi[e][k][d])
+                            parts[d].append(oi[e][k][d])
+                            flat.add(d)
                         elif oi[e][k][d].ndim==2:
-                            try:
-                                tmp[d] = np.append(tmp[d], oi[e][k][d], axis=0)
-                            except:
-                                #print('DEBUG:', e, k, d, tmp[d].shape, oi[e][k][d].shape)
-                                pass
+                            # -- as np.append(..., axis=0): ignored if shapes do not match
+                            if not d in flat and np.ndim(parts[d][0])==2 and \
+                                    np.shape(parts[d][0])[1:]==oi[e][k][d].shape[1:]:
+                                parts[d].append(oi[e][k][d])
                     else:
                         print('allInOneOI warning: unknow data', e, d)
+        for d in parts:
+            if len(parts[d])==1:
+                tmp[d] = parts[d][0]
+            elif d in flat:
+                tmp[d] = np.concatenate([np.ravel(x) for x in parts[d]])
+            else:
+                tmp[d] = np.concatenate(parts[d], axis=0)
+        if e=='OI_T3':
+            # -- T3 formula is recomputed below for all rows
+            t3formula = lists.pop('formula', None)
+        for d in lists:
+            # -- one copy per row
+            tmp[d] = [x for x, n in lists[d] for i in range(n)]
         tmp['NAME'] = np.array(tmp['NAME'])
         oi[e]['all'] = tmp
 
-    if 'OI_T3' in oi:
+    # -- hand-built or already merged data may not carry the T3 formula
+    if 'OI_T3' in oi and not t3formula is None:
         key = 'OI_VIS'
         if not key in oi:
             key = 'OI_VIS2'
         # -- recompute formula for T3
-        _w0, _w1, _w2 = [], [], []
-        _s0, _s1, _s2 = [], [], []
-        for i,mjd in enumerate(oi['OI_T3']['all']['MJD']):
-            s, t, w0, w1, w2 = oi['OI_T3']['all']['formula'][i]
-            _s0.append(s[0])
-            _s1.append(s[1])
-            _s2.append(s[2])
-            # _w0.append(np.argmin(abs(oi[key]['all']['MJD']-mjd)+(oi[key]['all']['NAME']!=t[0])))
-            # _w1.append(np.argmin(abs(oi[key]['all']['MJD']-mjd)+(oi[key]['all']['NAME']!=t[1])))
-            # _w2.append(np.argmin(abs(oi[key]['all']['MJD']-mjd)+(oi[key]['all']['NAME']!=t[2])))
-
-            _w0.append(np.argmin((oi[key]['all']['MJD']-mjd)**2+
-                                (oi[key]['all']['u']-s[0]*oi['OI_T3']['all']['u1'][i])**2+
-                                (oi[key]['all']['v']-s[0]*oi['OI_T3']['all']['v1'][i])**2))
-            _w1.append(np.argmin((oi[key]['all']['MJD']-mjd)**2+
-                                (oi[key]['all']['u']-s[1]*oi['OI_T3']['all']['u2'][i])**2+
-                                (oi[key]['all']['v']-s[1]*oi['OI_T3']['all']['v2'][i])**2))
-            _w2.append(np.argmin((oi[key]['all']['MJD']-mjd)**2+
-                                (oi[key]['all']['u']+s[2]*oi['OI_T3']['all']['u1'][i]+s[2]*oi['OI_T3']['all']['u2'][i])**2+
-                                (oi[key]['all']['v']+s[2]*oi['OI_T3']['all']['v1'][i]+s[2]*oi['OI_T3']['all']['v2'][i])**2))
-
-        s = np.array(_s0), np.array(_s1), np.array(_s2)
+        # -- signs of each row, from the (s, t, w0, w1, w2) formula of each triangle
+        s = tuple(np.repeat(np.array([f[0] for f, n in t3formula]).reshape(-1, 3),
+                            [n for f, n in t3formula], axis=0).T)
+
+        mjds = oi['OI_T3']['all']['MJD']
+        u1, v1 = oi['OI_T3']['all']['u1'], oi['OI_T3']['all']['v1']
+        u2, v2 = oi['OI_T3']['all']['u2'], oi['OI_T3']['all']['v2']
+        _w0, _w1, _w2 = [_matchMJDuv(oi[key]['all']['MJD'], oi[key]['all']['u'],
+                                     oi[key]['all']['v'], mjds, dU, dV)[0].tolist()
+                         for dU, dV in [([-s[0]*u1], [-s[0]*v1]), ([-s[1]*u2], [-s[1]*v2]),
+                                        ([s[2]*u1, s[2]*u2], [s[2]*v1, s[2]*v2])]]
         oi['OI_T3']['all']['formula'] = [s, ('all', 'all', 'all'), _w0, _w1, _w2]
     for e in filter(lambda x: x.startswith('OI_'), oi.keys()):
         for k in list(oi[e].keys()):
@@ -1821,59 +1804,89 @@ def _allInOneOI(oi, verbose=False, debug=False):
     oi['triangles'] = ['all']
     return oi
 
+def _medfiltRows(y, flag, kernel_size=3, t=None):
+    """
+    in place median filter (as scipy.signal.medfilt, zero padded edges) of
+    each row of the 2D array y, using only the points where flag is False
+    (flagged points are left untouched). If t is given,
+    y/t is filtered, then multiplied back by t. Rows sharing the same flags
+    are filtered in one call.
+    """
+    masks, inv = np.unique(~flag, axis=0, return_inverse=True)
+    inv = np.ravel(inv)
+    for j, mask in enumerate(masks):
+        w = np.ix_(np.flatnonzero(inv==j), np.flatnonzero(mask))
+        if t is None:
+            y[w] = scipy.ndimage.median_filter(y[w], size=(1, kernel_size),
+                                               mode='constant', cval=0.0)
+        else:
+            y[w] = scipy.ndimage.median_filter(y[w]/t[mask][None,:], size=(1, kernel_size),
+                                               mode='constant', cval=0.0)*t[mask][None,:]
+
 def medianFilt(oi, kernel_size=None):
     """
     kernel_size is the half width
     """
     if type(oi) == list:
         return [medianFilt(o, kernel_size=kernel_size) for o in oi]
+    if kernel_size is None:
+        kernel_size = 3
+    # -- errors are reduced by sqrt(kernel_size)
+    sk = np.sqrt(kernel_size)
 
     if 'OI_FLUX' in oi.keys():
         # -- make sure the tellurics are handled properly
         if 'TELLURICS' in oi.keys():
             t = oi['TELLURICS']
         else:
-            t = np.ones(np.len(oi['WL']))
+            t = np.ones(len(oi['WL']))
         for k in oi['OI_FLUX'].keys():
-            for i in range(len(oi['OI_FLUX'][k]['MJD'])):
-                mask = ~oi['OI_FLUX'][k]['FLAG'][i,:]
-                oi['OI_FLUX'][k]['FLUX'][i,mask] = scipy.signal.medfilt(
-                    oi['OI_FLUX'][k]['FLUX'][i,mask]/t[mask],
-                    kernel_size=kernel_size)*t[mask]
-                oi['OI_FLUX'][k]['EFLUX'][i,mask] /= np.sqrt(kernel_size)
+            flag = oi['OI_FLUX'][k]['FLAG']
+            _medfiltRows(oi['OI_FLUX'][k]['FLUX'], flag, kernel_size=kernel_size, t=t)
+            oi['OI_FLUX'][k]['EFLUX'][~flag] /= sk
     if 'OI_VIS' in oi.keys():
         for k in oi['OI_VIS'].keys():
-            for i in range(len(oi['OI_VIS'][k]['MJD'])):
-                mask = ~oi['OI_VIS'][k]['FLAG'][i,:]
-                oi['OI_VIS'][k]['|V|'][i,mask] = scipy.signal.medfilt(
-                    oi['OI_VIS'][k]['|V|'][i,mask], kernel_size=kernel_size)
-                oi['OI_VIS'][k]['E|V|'][i,mask] /= np.sqrt(kernel_size)
+            flag = oi['OI_VIS'][k]['FLAG']
+            _medfiltRows(oi['OI_VIS'][k]['|V|'], flag, kernel_size=kernel_size)
+            oi['OI_VIS'][k]['E|V|'][~flag] /= sk
 
-                oi['OI_VIS'][k]['PHI'][i,mask] = scipy.signal.medfilt(
-                    oi['OI_VIS'][k]['PHI'][i,mask], kernel_size=kernel_size)
-                oi['OI_VIS'][k]['EPHI'][i,mask] /= np.sqrt(kernel_size)
+            _medfiltRows(oi['OI_VIS'][k]['PHI'], flag, kernel_size=kernel_size)
+            oi['OI_VIS'][k]['EPHI'][~flag] /= sk
 
     if 'OI_VIS2' in oi.keys():
         for k in oi['OI_VIS2'].keys():
-            for i in range(len(oi['OI_VIS2'][k]['MJD'])):
-                mask = ~oi['OI_VIS2'][k]['FLAG'][i,:]
-                oi['OI_VIS2'][k]['V2'][i,mask] = scipy.signal.medfilt(
-                    oi['OI_VIS2'][k]['V2'][i,mask], kernel_size=kernel_size)
-                oi['OI_VIS2'][k]['EV2'][i,mask] /= np.sqrt(kernel_size)
+            flag = oi['OI_VIS2'][k]['FLAG']
+            _medfiltRows(oi['OI_VIS2'][k]['V2'], flag, kernel_size=kernel_size)
+            oi['OI_VIS2'][k]['EV2'][~flag] /= sk
 
     if 'OI_T3' in oi.keys():
         for k in oi['OI_T3'].keys():
-            for i in range(len(oi['OI_T3'][k]['MJD'])):
-                mask = ~oi['OI_T3'][k]['FLAG'][i,:]
-                oi['OI_T3'][k]['T3PHI'][i,mask] = scipy.signal.medfilt(
-                    oi['OI_T3'][k]['T3PHI'][i,mask], kernel_size=kernel_size)
-                oi['OI_T3'][k]['ET3PHI'][i,mask] /= np.sqrt(kernel_size)
-
-                oi['OI_T3'][k]['T3AMP'][i,mask] = scipy.signal.medfilt(
-                    oi['OI_T3'][k]['T3AMP'][i,mask], kernel_size=kernel_size)
-                oi['OI_T3'][k]['ET3AMP'][i,mask] /= np.sqrt(kernel_size)
+            flag = oi['OI_T3'][k]['FLAG']
+            _medfiltRows(oi['OI_T3'][k]['T3PHI'], flag, kernel_size=kernel_size)
+            oi['OI_T3'][k]['ET3PHI'][~flag] /= sk
+
+            _medfiltRows(oi['OI_T3'][k]['T3AMP'], flag, kernel_size=kernel_size)
+            oi['OI_T3'][k]['ET3AMP'][~flag] /= sk
     return oi
 
+# -- https://arxiv.org/pdf/physics/0610256.pdf
+# -- table 1
+# -- i; ciref / cmi; ciT / cmiK;  ciTT / [cmiK2]; ciH / [cmi/%]; ciHH / [cmi/%2]
+_mathar_table1a = np.array([[0, 0.200192e-3, 0.588625e-1, -3.01513, -0.103945e-7, 0.573256e-12],
+                            [1, 0.113474e-9, -0.385766e-7, 0.406167e-3, 0.136858e-11, 0.186367e-16],
+                            [2, -0.424595e-14, 0.888019e-10, -0.514544e-6, -0.171039e-14, -0.228150e-19],
+                            [3, 0.100957e-16, -0.567650e-13, 0.343161e-9, 0.112908e-17, 0.150947e-22],
+                            [4, -0.293315e-20, 0.166615e-16, -0.101189e-12, -0.329925e-21, -0.441214e-26],
+                            [5, 0.307228e-24, -0.174845e-20, 0.106749e-16, 0.344747e-25, 0.461209e-30]])
+
+# -- cip / [cmi/Pa]; cipp / [cmi/Pa2]; ciTH / [cmiK/%]; ciTp / [cmiK/Pa]; ciHp / [cmi/(% Pa)]
+_mathar_table1b = np.array([[0, 0.267085e-8, 0.609186e-17, 0.497859e-4, 0.779176e-6, -0.206567e-15],
+                            [1, 0.135941e-14, 0.519024e-23, -0.661752e-8, 0.396499e-12, 0.106141e-20],
+                            [2, 0.135295e-18, -0.419477e-27, 0.832034e-11, 0.395114e-16, -0.149982e-23],
+                            [3, 0.818218e-23, 0.434120e-30, -0.551793e-14, 0.233587e-20, 0.984046e-27],
+                            [4, -0.222957e-26, -0.122445e-33, 0.161899e-17, -0.636441e-24, -0.288266e-30],
+                            [5, 0.249964e-30, 0.134816e-37, -0.169901e-21, 0.716868e-28, 0.299105e-34]])
+
 def n_JHK(wl, T=None, P=None, H=None):
     """
     wl: wavelength in microns (only valid from 1.3 to 2.5um)
@@ -1886,24 +1899,6 @@ def n_JHK(wl, T=None, P=None, H=None):
     nu = 1e4/wl
     nuref = 1e4/2.25 # cm−1
 
-    # -- https://arxiv.org/pdf/physics/0610256.pdf
-    # -- table 1
-    # -- i; ciref / cmi; ciT / cmiK;  ciTT / [cmiK2]; ciH / [cmi/%]; ciHH / [cmi/%2]
-    table1a=[[0, 0.200192e-3, 0.588625e-1, -3.01513, -0.103945e-7, 0.573256e-12],
-             [1, 0.113474e-9, -0.385766e-7, 0.406167e-3, 0.136858e-11, 0.186367e-16],
-             [2, -0.424595e-14, 0.888019e-10, -0.514544e-6, -0.171039e-14, -0.228150e-19],
-             [3, 0.100957e-16, -0.567650e-13, 0.343161e-9, 0.112908e-17, 0.150947e-22],
-             [4, -0.293315e-20, 0.166615e-16, -0.101189e-12, -0.329925e-21, -0.441214e-26],
-             [5, 0.307228e-24, -0.174845e-20, 0.106749e-16, 0.344747e-25, 0.461209e-30]]
-
-    # -- cip / [cmi/Pa]; cipp / [cmi/Pa2]; ciTH / [cmiK/%]; ciTp / [cmiK/Pa]; ciHp / [cmi/(% Pa)]
-    table1b = [[0, 0.267085e-8, 0.609186e-17, 0.497859e-4, 0.779176e-6, -0.206567e-15],
-               [1, 0.135941e-14, 0.519024e-23, -0.661752e-8, 0.396499e-12, 0.106141e-20],
-               [2, 0.135295e-18, -0.419477e-27, 0.832034e-11, 0.395114e-16, -0.149982e-23],
-               [3, 0.818218e-23, 0.434120e-30, -0.551793e-14, 0.233587e-20, 0.984046e-27],
-               [4, -0.222957e-26, -0.122445e-33, 0.161899e-17, -0.636441e-24, -0.288266e-30],
-               [5, 0.249964e-30, 0.134816e-37, -0.169901e-21, 0.716868e-28, 0.299105e-34]]
-
     Tref, Href, pref = 273.15+17.5, 10., 75e3
     if T is None:
         T = Tref
@@ -1912,31 +1907,29 @@ def n_JHK(wl, T=None, P=None, H=None):
     if H is None:
         H = Href
 
-    n = 0.0
     p = P*100 # formula in Pa, not mbar
+    dT, dH, dp = 1/T-1/Tref, H-Href, p-pref
+
+    # -- equation 7, for all i at once
+    _, ciref, ciT, ciTT, ciH, ciHH = _mathar_table1a.T
+    _, cip, cipp, ciTH, ciTp, ciHp = _mathar_table1b.T
+    ci = ciref + ciT*dT + ciTT*dT**2 + ciH*dH + ciHH*dH**2 + cip*dp + cipp*dp**2 +\
+         ciTH*dT*dH + ciTp*dT*dp + ciHp*dH*dp
 
-    for k,ca in enumerate(table1a):
-        i = ca[0]
-        ciref = ca[1]
-        ciT = ca[2]
-        ciTT = ca[3]
-        ciH = ca[4]
-        ciHH = ca[5]
-        cb = table1b[k]
-        cip = cb[1]
-        cipp = cb[2]
-        ciTH = cb[3]
-        ciTp = cb[4]
-        ciHp = cb[5]
-        # -- equation 7
-        ci = ciref + ciT*(1/T - 1/Tref) + ciTT*(1/T - 1/Tref)**2 +\
-            ciH*(H-Href) + ciHH*(H-Href)**2 + cip*(p-pref) + cipp*(p-pref)**2 +\
-            ciTH*(1/T-1/Tref)*(H-Href) + ciTp*(1/T-1/Tref)*(p-pref) +\
-            ciHp*(H-Href)*(p-pref)
-        # -- equation 6
-        #print('mathar:', i, ciref, ci)
-        n += ci*(nu - nuref)**i
-    return n+1.0
+    # -- equation 6, with Horner's scheme (n-1 -> n folded in the constant term)
+    ci[0] += 1.0
+    return np.polynomial.polynomial.polyval(nu - nuref, ci)
+
+@functools.lru_cache(maxsize=128)
+def _n_JHK_cached(wl_bytes, T, P, H):
+    """
+    n_JHK for a float64 array of wavelengths passed as bytes (to be hashable):
+    the same wavelength table and conditions come back for every file of a
+    given night / setup.
+    """
+    n = n_JHK(np.frombuffer(wl_bytes, dtype=np.float64), T, P, H)
+    n.flags.writeable = False
+    return n
 
 def OI2FITS(oi, fitsfile):
     pass
@@ -0,0 +1,39 @@
+import os
+import unittest
+
+import numpy as np
+
+from pmoired import oifits
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# -- PIONIER file with the ESO ISS ambient conditions in its header
+PIONIER = os.path.join(ROOT, 'examples', 'alphaCenA',
+                       'PIONI.2016-05-31T00_55_19.075_oidataCalibrated.fits')
+
+class TestNLab(unittest.TestCase):
+    def test_n_lab_reloaded(self):
+        # -- second load comes from the n_JHK cache
+        a = oifits.loadOI(PIONIER, verbose=False)['n_lab']
+        b = oifits.loadOI(PIONIER, verbose=False)['n_lab']
+        self.assertTrue(np.array_equal(a, b))
+        self.assertFalse(np.shares_memory(a, b))
+        # -- results are copies: modifying one does not alter the cache
+        ref = b.copy()
+        a *= 2
+        b[:] = 0
+        c = oifits.loadOI(PIONIER, verbose=False)['n_lab']
+        self.assertTrue(np.array_equal(c, ref))
+
+    def test_n_lab_cache_key(self):
+        # -- key is the float64 bytes of WL: independent of the memory layout
+        wl = np.linspace(1.5, 2.5, 40)[::2]
+        ref = oifits.n_JHK(wl, 290., 743., 15.)
+        for x in [wl, wl.copy(), wl.astype(np.float32)]:
+            n = oifits._n_JHK_cached(x.astype(np.float64).tobytes(), 290., 743., 15.)
+            self.assertTrue(np.allclose(n, oifits.n_JHK(np.float64(x), 290., 743., 15.)))
+            self.assertFalse(n.flags.writeable)
+        n = oifits._n_JHK_cached(wl.astype(np.float64).tobytes(), 290., 743., 15.)
+        self.assertTrue(np.array_equal(n, ref))
+
+if __name__ == '__main__':
+    unittest.main()